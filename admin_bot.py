@@ -4,12 +4,18 @@ from telegram.ext import (
     Application, CommandHandler, ContextTypes, MessageHandler, 
     filters, ConversationHandler, CallbackContext
 )
+from telegram.request import HTTPXRequest
 import logging
 import os
 import re
 import json
 import os.path
-from database import Database
+from database import AsyncDatabase
+from webhook import WEBHOOK_BASE_URL, run_webhook
+from rate_limit import TokenBucket
+from metrics import (
+    TITLE_BATCH_SECONDS, TITLE_UPDATES, instrument_application, instrumented_request, serve_metrics
+)
 import asyncio
 from datetime import datetime, timedelta
 import dotenv
@@ -25,51 +31,53 @@ logger = logging.getLogger(__name__)
 
 TOKEN: Final[str] = os.getenv("ADMIN_BOT_TOKEN")
 BOT_USERNAME: Final[str] = os.getenv("ADMIN_BOT_USERNAME")
+DATABASE: Final[str] = os.getenv("DATABASE_PATH", "ratings.db")
+METRICS_PORT: Final[str] = os.getenv("ADMIN_METRICS_PORT")
+WEBHOOK_PORT: Final[int] = int(os.getenv("ADMIN_WEBHOOK_PORT", "8444"))
 
 # File to store admin mappings
 MAPPINGS_FILE = "admin_mappings.json"
 
-# Initialize database
-db = Database()
+# Telegram allows about 30 API calls per second per bot and 20 per minute in one group
+TITLE_UPDATES_PER_SECOND = 30
+CHAT_TITLE_UPDATES_PER_MINUTE = 20
+MAX_CONCURRENT_TITLE_UPDATES = 8
 
-# Load admin mappings from file
-def load_admin_mappings():
-    if os.path.exists(MAPPINGS_FILE):
-        try:
-            with open(MAPPINGS_FILE, 'r') as f:
-                # Convert string keys back to integers
-                data = json.load(f)
-                mappings = {}
-                for chat_id_str, users in data.items():
-                    chat_id = int(chat_id_str)
-                    mappings[chat_id] = {}
-                    for user_id_str, player_index in users.items():
-                        user_id = int(user_id_str)
-                        mappings[chat_id][user_id] = player_index
-                return mappings
-        except Exception as e:
-            logger.error(f"Error loading admin mappings: {e}")
-    return {}
+# Seconds between checks of the rating history feed, and between full reconciliation passes
+TITLE_FEED_INTERVAL = float(os.getenv("TITLE_FEED_INTERVAL", "2"))
+TITLE_RECONCILE_INTERVAL = int(os.getenv("TITLE_RECONCILE_INTERVAL", "900"))
 
-# Save admin mappings to file
-def save_admin_mappings():
+# Initialize database, served from its own thread so handlers never block the event loop
+db = AsyncDatabase(DATABASE)
+
+# Import the mappings kept in MAPPINGS_FILE by earlier versions, then retire the file
+def import_admin_mappings_file(database):
+    if not os.path.exists(MAPPINGS_FILE):
+        return
     try:
-        # Convert all keys to strings for JSON serialization
-        data = {}
-        for chat_id, users in admin_mappings.items():
-            data[str(chat_id)] = {}
-            for user_id, player_index in users.items():
-                data[str(chat_id)][str(user_id)] = player_index
-                
-        with open(MAPPINGS_FILE, 'w') as f:
-            json.dump(data, f)
-        logger.info("Admin mappings saved successfully")
+        with open(MAPPINGS_FILE, 'r') as f:
+            data = json.load(f)
+        # JSON keys are strings; the table stores chat and user ids as integers
+        mappings = [
+            (int(chat_id_str), int(user_id_str), player_index)
+            for chat_id_str, users in data.items()
+            for user_id_str, player_index in users.items()
+        ]
+        database.import_admin_mappings(mappings)
+        os.replace(MAPPINGS_FILE, MAPPINGS_FILE + ".imported")
+        logger.info(f"Imported {len(mappings)} admin mappings from {MAPPINGS_FILE}")
     except Exception as e:
-        logger.error(f"Error saving admin mappings: {e}")
+        logger.error(f"Error importing admin mappings: {e}")
 
-# Dictionary to store user_id to player_index mapping for admins
-# Format: {chat_id: {user_id: player_index}}
-admin_mappings = load_admin_mappings()
+# Rate limits for title updates: one bucket for the bot and one per chat
+title_bucket = TokenBucket(TITLE_UPDATES_PER_SECOND, TITLE_UPDATES_PER_SECOND)
+chat_title_buckets: Dict[int, TokenBucket] = {}
+title_update_slots = asyncio.Semaphore(MAX_CONCURRENT_TITLE_UPDATES)
+
+# Position in the rating_history feed; None until the first check
+feed_history_id = None
+feed_data_version = None
+feed_ratings_version = None
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a message when the command /start is issued."""
@@ -97,7 +105,7 @@ async def promote_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     player_index = context.args[0]
     
     # Check if the player exists in the database
-    user = db.get_user_by_index(player_index)
+    user = await db.get_user_by_index(player_index)
     if not user:
         await update.message.reply_text(f"No player found with ID {player_index}.")
         return
@@ -139,13 +147,8 @@ async def promote_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
             custom_title=custom_title
         )
         
-        # Store the mapping for periodic updates
-        if chat.id not in admin_mappings:
-            admin_mappings[chat.id] = {}
-        admin_mappings[chat.id][user_id] = player_index
-        
-        # Save the updated mappings
-        save_admin_mappings()
+        # Store the mapping for title updates, with the title it shows now
+        await db.set_admin_mapping(chat.id, user_id, player_index, custom_title)
         
         await update.message.reply_text(
             f"User {user_name} {user_surname} has been promoted to admin with restricted rights.\n"
@@ -156,54 +159,130 @@ async def promote_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Error promoting user: {e}")
         await update.message.reply_text(f"Failed to promote user: {e}")
 
+async def set_admin_title(bot, chat_id: int, user_id: int, custom_title: str) -> bool:
+    """Set one admin title within the rate limits, returning whether it was applied."""
+    if chat_id not in chat_title_buckets:
+        chat_title_buckets[chat_id] = TokenBucket(CHAT_TITLE_UPDATES_PER_MINUTE / 60, CHAT_TITLE_UPDATES_PER_MINUTE)
+    
+    # Wait for the chat's own limit first, so a busy chat never holds a slot or a bot-wide
+    # token that other chats could use meanwhile
+    await chat_title_buckets[chat_id].acquire()
+    async with title_update_slots:
+        await title_bucket.acquire()
+        try:
+            await bot.set_chat_administrator_custom_title(
+                chat_id=chat_id,
+                user_id=user_id,
+                custom_title=custom_title
+            )
+        except Exception as e:
+            # Failures are counted and summarized per refresh instead of logged one by one
+            logger.debug(f"Error updating title for user {user_id} in chat {chat_id}: {e}")
+            return False
+    
+    logger.debug(f"Updated title for user {user_id} in chat {chat_id} to {custom_title}")
+    return True
+
+async def refresh_titles(bot, user_ids=None, trigger: str = 'reconcile', force: bool = False):
+    """Bring admin titles in line with the database, for every admin or only those tied to the given players.
+    
+    Titles already applied are skipped unless force is set.
+    """
+    with TITLE_BATCH_SECONDS.time(trigger):
+        await _refresh_titles(bot, user_ids, force)
+
+async def _refresh_titles(bot, user_ids, force: bool):
+    # Every mapping comes with its player's rating from one query
+    admins = await db.get_admin_titles(user_ids)
+    if not admins:
+        return
+    
+    updates = []
+    missing = set()
+    for chat_id, user_id, player_index, elo, applied_title in admins:
+        if elo is None:
+            missing.add(player_index)
+            continue
+        
+        # Only send titles whose ELO changed since they were last applied, even before a restart
+        custom_title = f"ELO: {elo}"
+        if force or applied_title != custom_title:
+            updates.append((custom_title, chat_id, user_id))
+    
+    results = await asyncio.gather(*(
+        set_admin_title(bot, chat_id, user_id, custom_title) for custom_title, chat_id, user_id in updates
+    ))
+    applied = [update for update, result in zip(updates, results) if result]
+    if applied:
+        await db.set_applied_titles(applied)
+    updated = sum(results)
+    failed = len(results) - updated
+    unchanged = len(admins) - len(updates) - len(missing)
+    TITLE_UPDATES.inc('updated', amount=updated)
+    TITLE_UPDATES.inc('failed', amount=failed)
+    TITLE_UPDATES.inc('unchanged', amount=unchanged)
+    TITLE_UPDATES.inc('missing', amount=len(missing))
+    
+    if missing:
+        logger.warning(f"{len(missing)} tied player indexes no longer exist in database, e.g. {min(missing)}")
+    if updated or failed:
+        logger.log(logging.WARNING if failed else logging.INFO,
+                   f"Admin titles: {updated} updated, {failed} failed, {unchanged} unchanged")
+
 async def update_admin_titles(context: CallbackContext):
-    """Periodically update the custom titles of all admins with tied IDs."""
-    logger.info("Running scheduled update of admin titles")
-    
-    for chat_id, users in admin_mappings.items():
-        for user_id, player_index in users.items():
-            try:
-                # Get updated user data from database
-                user = db.get_user_by_index(player_index)
-                if not user:
-                    logger.warning(f"User with player_index {player_index} no longer exists in database")
-                    continue
-                
-                user_elo = user[4]  # ELO rating from database
-                
-                # Update custom title
-                custom_title = f"ELO: {user_elo}"
-                await context.bot.set_chat_administrator_custom_title(
-                    chat_id=chat_id,
-                    user_id=user_id,
-                    custom_title=custom_title
-                )
-                
-                logger.info(f"Updated title for user {user_id} in chat {chat_id} to {custom_title}")
-                
-            except Exception as e:
-                logger.error(f"Error updating title for user {user_id} in chat {chat_id}: {e}")
+    """Periodically reconcile the custom titles of all admins with tied IDs."""
+    await refresh_titles(context.bot, trigger='reconcile')
+
+async def follow_rating_changes(context: CallbackContext):
+    """Update the titles of players whose games were confirmed since the last check.
+    
+    lelo_bot writes a rating_history row for both players of every confirmed game,
+    so the table doubles as a change feed. Checking PRAGMA data_version first keeps
+    idle checks from touching the table at all.
+    """
+    global feed_history_id, feed_data_version, feed_ratings_version
+    
+    data_version = await db.get_data_version()
+    if data_version == feed_data_version:
+        return
+    feed_data_version = data_version
+    
+    ratings_version = await db.get_ratings_version()
+    if feed_history_id is None or ratings_version != feed_ratings_version:
+        # Earlier changes are covered by the reconciliation pass; a recompute rewrites the
+        # whole history, so it is followed by a full pass instead of through the feed
+        recomputed = feed_history_id is not None
+        feed_ratings_version = ratings_version
+        feed_history_id = await db.get_last_history_id()
+        if recomputed:
+            await refresh_titles(context.bot, trigger='recompute')
+        return
+    
+    changes = await db.get_rating_changes_since(feed_history_id)
+    if not changes:
+        return
+    feed_history_id = changes[-1][0]
+    
+    await refresh_titles(context.bot, {user_id for _, user_id in changes}, trigger='feed')
 
 async def update_titles_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Manually update all admin titles."""
     await update.message.reply_text("Updating all admin titles...")
     
-    # Create a context-like object with a bot attribute
-    class DummyContext:
-        def __init__(self, bot):
-            self.bot = bot
-    
-    dummy_context = DummyContext(context.bot)
-    
-    # Call the update function
-    await update_admin_titles(dummy_context)
+    # A manual refresh re-sends every title, even those believed to be current
+    await refresh_titles(context.bot, trigger='manual', force=True)
     
     await update.message.reply_text("Admin titles updated successfully!")
 
-def main():
-    """Start the bot."""
-    # Create the Application
-    application = Application.builder().token(TOKEN).build()
+def build_application(request=None) -> Application:
+    """Create the bot application with all handlers and jobs; request replaces the HTTP client"""
+    # Create the Application; Bot API calls go through a wrapper that counts them
+    builder = Application.builder().token(TOKEN)
+    builder = builder.request(instrumented_request(request or HTTPXRequest(connection_pool_size=256), 'admin'))
+    builder = builder.get_updates_request(instrumented_request(request or HTTPXRequest(), 'admin'))
+    application = builder.build()
+    
+    db.run_sync(import_admin_mappings_file)
     
     # Add command handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -215,7 +294,7 @@ def main():
     # Add handler for update_titles command
     application.add_handler(CommandHandler("update_titles", update_titles_command))
     
-    # Schedule periodic updates (every minute)
+    # Follow confirmed games within seconds and reconcile everything occasionally
     try:
         job_queue = application.job_queue
         if job_queue is None:
@@ -223,14 +302,28 @@ def main():
             logger.warning("Run: pip install 'python-telegram-bot[job-queue]'")
             logger.warning("Title updates will not run automatically")
         else:
-            job_queue.run_repeating(update_admin_titles, interval=60, first=10)
-            logger.info("Scheduled automatic title updates every 60 seconds")
+            job_queue.run_repeating(follow_rating_changes, interval=TITLE_FEED_INTERVAL, first=1)
+            job_queue.run_repeating(update_admin_titles, interval=TITLE_RECONCILE_INTERVAL, first=10)
+            logger.info(f"Following rating changes every {TITLE_FEED_INTERVAL} seconds, "
+                        f"reconciling all titles every {TITLE_RECONCILE_INTERVAL} seconds")
     except Exception as e:
         logger.error(f"Error setting up job queue: {e}")
         logger.warning("Title updates will not run automatically")
     
+    instrument_application(application, 'admin')
+    return application
+
+def main():
+    """Start the bot."""
+    application = build_application()
+    if METRICS_PORT:
+        serve_metrics(int(METRICS_PORT))
+    
     # Start the Bot
-    application.run_polling()
+    if WEBHOOK_BASE_URL:
+        run_webhook('admin', application, WEBHOOK_PORT)
+    else:
+        application.run_polling()
     
     logger.info("Bot started")
 
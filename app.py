@@ -1,75 +1,356 @@
-from flask import Flask, render_template, request, jsonify
-import sqlite3
+from flask import Flask, Response, abort, g, render_template, request, jsonify, stream_with_context
+from database import Database, DatabasePool
+from export import EXPORT_FORMATS, export_chunks
+from leaderboard import Leaderboard
+import metrics
+import gzip
+import hashlib
+import hmac
+import json
 import math
+import os
+import time
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DATABASE = os.getenv('DATABASE_PATH', 'ratings.db')
+
+# Bearer token required by the export endpoint, which is disabled when it is unset
+EXPORT_TOKEN = os.getenv('EXPORT_TOKEN')
 
 app = Flask(__name__)
+app.config.setdefault('PAGE_SIZE', 10)
 
-def get_db_connection():
-    conn = sqlite3.connect('ratings.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+# Loopback addresses allowed to scrape /metrics
+METRICS_CLIENTS = ('127.0.0.1', '::1')
 
-@app.route('/')
-def home():
-    page = request.args.get('page', 1, type=int)
-    search = request.args.get('search', '')
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    # Streamed exports are timed until their response starts
+    if 'request_start' in g:
+        metrics.HTTP_SECONDS.observe(time.perf_counter() - g.request_start, request.endpoint, response.status_code)
+    return response
+
+# Pooled connections shared by all request threads
+db_pool = DatabasePool(DATABASE)
+
+# In-memory leaderboard, kept in sync with the bots' writes through its own connection
+leaderboard = Leaderboard()
+leaderboard_db = Database(DATABASE, check_same_thread=False)
+leaderboard.load(leaderboard_db)
+
+# Search result counts, valid until the next write to the database
+MAX_CACHED_COUNTS = 1024
+search_counts = {'version': None, 'counts': {}}
+
+def count_search_results(search: str) -> int:
+    counts = search_counts['counts']
+    if search_counts['version'] != leaderboard.data_version or len(counts) >= MAX_CACHED_COUNTS:
+        counts = {}
+        search_counts['version'] = leaderboard.data_version
+        search_counts['counts'] = counts
     
-    conn = get_db_connection()
+    if search not in counts:
+        with db_pool.acquire() as db:
+            counts[search] = db.count_users(search)
+    return counts[search]
+
+# Rendered leaderboard pages with their ETags, valid until the next write to the database
+MAX_CACHED_PAGES = 1024
+rendered_pages = {'version': None, 'pages': {}}
+
+def make_etag(body: bytes) -> str:
+    return hashlib.sha1(body).hexdigest()
+
+def conditional_response(body: bytes, etag: str, mimetype: str = 'text/html', headers=None):
+    """Send body with a strong ETag, or 304 Not Modified if the client already has it"""
+    response = app.response_class(body, mimetype=mimetype, headers=headers)
+    response.set_etag(etag)
+    # Browsers may keep the page but must revalidate it, which costs a 304 at most
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+# Fields the JSON API can return for a player; Telegram user ids are never exposed
+PLAYER_FIELDS = ('name', 'surname', 'position', 'elo', 'games_played', 'player_index', 'rank')
+GAME_FIELDS = ('game_id', 'timestamp', 'player1_name', 'player2_name', 'player1_score',
+               'player2_score', 'opponent', 'result')
+# Search results come from the name index and carry no position
+SEARCH_FIELDS = tuple(field for field in PLAYER_FIELDS if field != 'position')
+MAX_API_PAGE_SIZE = 100
+
+# JSON bodies smaller than this are sent uncompressed
+MIN_COMPRESSED_SIZE = 512
+
+class ApiError(Exception):
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+@app.errorhandler(ApiError)
+def api_error(error):
+    return jsonify({'error': str(error)}), error.status
+
+def requested_fields(available: tuple) -> tuple:
+    """Fields named in ?fields=a,b (all of them by default), in the requested order"""
+    fields = request.args.get('fields')
+    if not fields:
+        return available
+    fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+    unknown = [field for field in fields if field not in available]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def encode_records(records, available: tuple):
+    """Project records onto the requested fields.
     
-    # Count total players for pagination
-    if search:
-        count = conn.execute(
-            "SELECT COUNT(*) FROM users WHERE name || ' ' || surname LIKE ?", 
-            (f'%{search}%',)
-        ).fetchone()[0]
-    else:
-        count = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    ?format=rows returns {"fields": [...], "rows": [[...], ...]}, which drops the
+    repeated keys; by default every record is an object.
+    """
+    fields = requested_fields(available)
+    if request.args.get('format') == 'rows':
+        return {'fields': fields, 'rows': [[record[field] for field in fields] for record in records]}
+    return [{field: record[field] for field in fields} for record in records]
+
+def json_response(payload):
+    """Compact JSON with a strong ETag, compressed with brotli or gzip when the client accepts it"""
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False).encode()
+    etag = make_etag(body)
+    headers = {'Vary': 'Accept-Encoding'}
     
-    # Calculate total pages
-    total_pages = math.ceil(count / 10)
+    encoding = None
+    if len(body) >= MIN_COMPRESSED_SIZE:
+        encoding = request.accept_encodings.best_match(['br', 'gzip'] if brotli else ['gzip'])
+    if encoding == 'br':
+        body = brotli.compress(body, quality=5)
+    elif encoding == 'gzip':
+        body = gzip.compress(body, compresslevel=6)
+    if encoding:
+        # Each encoding is a different representation and needs its own strong ETag
+        headers['Content-Encoding'] = encoding
+        etag = f"{etag}-{encoding}"
     
-    # Get players for current page
-    offset = (page - 1) * 10
+    return conditional_response(body, etag, 'application/json', headers)
+
+def parse_cursor(value: str):
+    """Parse an 'elo:user_id' page cursor, returning None if it is missing or malformed"""
+    try:
+        elo, user_id = value.split(':')
+        return int(elo), int(user_id)
+    except (AttributeError, ValueError):
+        return None
+
+def format_cursor(player) -> str:
+    return f"{player['elo']}:{player['user_id']}"
+
+def render_home(page: int, search: str, after, before) -> bytes:
+    page_size = app.config['PAGE_SIZE']
     
     if search:
-        players = conn.execute(
-            """
-            SELECT name, surname, elo, games_played, 
-                   ROW_NUMBER() OVER (ORDER BY elo DESC) as rank
-            FROM users 
-            WHERE name || ' ' || surname LIKE ? 
-            ORDER BY elo DESC LIMIT 10 OFFSET ?
-            """, 
-            (f'%{search}%', offset)
-        ).fetchall()
+        # Previous/next links carry a (elo, user_id) cursor so sequential paging seeks
+        # instead of skipping rows; jumping to a page number falls back to an offset
+        with db_pool.acquire() as db:
+            rows = db.get_leaderboard_page(page_size, search, after, before, (page - 1) * page_size)
+        
+        # Global ranks come from the in-memory leaderboard, so search never sorts every user
+        players = []
+        for row in rows:
+            player = dict(zip(('user_id', 'name', 'surname', 'elo', 'games_played', 'player_index'), row))
+            player['rank'] = leaderboard.rank(player['user_id'])
+            players.append(player)
+        count = count_search_results(search)
     else:
-        players = conn.execute(
-            """
-            SELECT name, surname, elo, games_played,
-                   ROW_NUMBER() OVER (ORDER BY elo DESC) as rank
-            FROM users 
-            ORDER BY elo DESC LIMIT 10 OFFSET ?
-            """, 
-            (offset,)
-        ).fetchall()
-    
-    conn.close()
+        count = len(leaderboard)
+        players = leaderboard.page(page, page_size)
+    
+    # Calculate total pages
+    total_pages = math.ceil(count / page_size)
+    
+    # Link the first and last three pages and the neighbours of the current one
+    page_numbers = sorted({
+        i for i in (1, 2, 3, page - 1, page, page + 1, total_pages - 2, total_pages - 1, total_pages)
+        if 1 <= i <= total_pages
+    })
     
     return render_template(
         'home.html', 
         players=players, 
         page=page, 
         total_pages=total_pages,
-        search=search
+        page_numbers=page_numbers,
+        search=search,
+        prev_cursor=format_cursor(players[0]) if players else None,
+        next_cursor=format_cursor(players[-1]) if players else None
+    ).encode()
+
+@app.route('/')
+def home():
+    page = request.args.get('page', 1, type=int)
+    search = request.args.get('search', '')
+    after = parse_cursor(request.args.get('after')) if search else None
+    before = parse_cursor(request.args.get('before')) if search else None
+    
+    leaderboard.sync(leaderboard_db)
+    
+    # Pages only change when another process commits, which bumps the data version
+    pages = rendered_pages['pages']
+    if rendered_pages['version'] != leaderboard.data_version or len(pages) >= MAX_CACHED_PAGES:
+        pages = {}
+        rendered_pages['version'] = leaderboard.data_version
+        rendered_pages['pages'] = pages
+    
+    key = (page, search, after, before)
+    if key not in pages:
+        body = render_home(page, search, after, before)
+        pages[key] = (body, make_etag(body))
+    return conditional_response(*pages[key])
+
+@app.route('/api/leaderboard')
+def api_leaderboard():
+    """JSON leaderboard page: ?page=1&page_size=10&fields=name,elo&format=rows"""
+    page = max(request.args.get('page', 1, type=int), 1)
+    page_size = min(max(request.args.get('page_size', app.config['PAGE_SIZE'], type=int), 1), MAX_API_PAGE_SIZE)
+    
+    leaderboard.sync(leaderboard_db)
+    players = leaderboard.page(page, page_size)
+    
+    return json_response({
+        'page': page,
+        'page_size': page_size,
+        'total_players': len(leaderboard),
+        'total_pages': math.ceil(len(leaderboard) / page_size),
+        'players': encode_records(players, PLAYER_FIELDS),
+    })
+
+@app.route('/api/players/search')
+def search_players():
+    """JSON typeahead: best rated players whose name matches q"""
+    search = request.args.get('q', '').strip()
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    if not search:
+        return json_response([])
+    
+    leaderboard.sync(leaderboard_db)
+    with db_pool.acquire() as db:
+        rows = db.search_users(search, limit)
+    
+    players = []
+    for user_id, name, surname, elo, games_played, player_index in rows:
+        players.append({
+            'name': name,
+            'surname': surname,
+            'elo': elo,
+            'games_played': games_played,
+            'player_index': player_index,
+            'rank': leaderboard.rank(user_id),
+        })
+    return json_response(encode_records(players, SEARCH_FIELDS))
+
+def find_player(player_index: str):
+    with db_pool.acquire() as db:
+        user = db.get_user_by_index(player_index)
+    if user is None:
+        raise ApiError(f"No player with index {player_index}", 404)
+    return user
+
+@app.route('/api/players/<player_index>')
+def api_player(player_index):
+    """JSON profile of one player, with their global rank"""
+    user = find_player(player_index)
+    leaderboard.sync(leaderboard_db)
+    player = {
+        'name': user['name'],
+        'surname': user['surname'],
+        'position': user['position'],
+        'elo': user['elo'],
+        'games_played': user['games_played'],
+        'player_index': user['player_index'],
+        'rank': leaderboard.rank(user['user_id']),
+    }
+    players = encode_records([player], PLAYER_FIELDS)
+    # A single profile is one object unless rows were asked for
+    return json_response(players if request.args.get('format') == 'rows' else players[0])
+
+@app.route('/api/players/<player_index>/games')
+def api_player_games(player_index):
+    """JSON match history of one player, most recent first: ?limit=10"""
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_API_PAGE_SIZE)
+    user = find_player(player_index)
+    with db_pool.acquire() as db:
+        rows = db.get_user_games(user['user_id'], limit)
+    
+    games = []
+    for game in rows:
+        # Scores and opponent seen from the requested player's side
+        is_player1 = game['player1_id'] == user['user_id']
+        own, other = game['player1_score'], game['player2_score']
+        if not is_player1:
+            own, other = other, own
+        games.append({
+            'game_id': game['game_id'],
+            'timestamp': game['timestamp'],
+            'player1_name': game['player1_name'],
+            'player2_name': game['player2_name'],
+            'player1_score': game['player1_score'],
+            'player2_score': game['player2_score'],
+            'opponent': game['player2_name'] if is_player1 else game['player1_name'],
+            'result': 'win' if own > other else 'loss' if own < other else 'draw',
+        })
+    return json_response({'player_index': user['player_index'], 'games': encode_records(games, GAME_FIELDS)})
+
+@app.route('/export/<table>.<fmt>')
+def export(table, fmt):
+    """Stream users or confirmed games as CSV or NDJSON: ?since=<game_id> for increments"""
+    token = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not EXPORT_TOKEN or not hmac.compare_digest(token, EXPORT_TOKEN):
+        abort(404)
+    if table not in Database.EXPORT_COLUMNS or fmt not in EXPORT_FORMATS:
+        abort(404)
+    since = max(request.args.get('since', 0, type=int), 0)
+    
+    def generate():
+        # The pooled connection is held until the last chunk has been sent
+        with db_pool.acquire() as db:
+            yield from export_chunks(db, table, fmt, since)
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype=EXPORT_FORMATS[fmt],
+        headers={'Content-Disposition': f'attachment; filename={table}.{fmt}'}
     )
 
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus metrics of this process, including any bots attached by serve.py"""
+    if request.remote_addr not in METRICS_CLIENTS:
+        abort(404)
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+def precompile_page(path: str, template: str):
+    """Render a page without dynamic content once, returning its body and ETag"""
+    with app.test_request_context(path):
+        body = render_template(template).encode()
+    return body, make_etag(body)
+
+static_pages = {
+    '/about': precompile_page('/about', 'about.html'),
+    '/contacts': precompile_page('/contacts', 'contacts.html'),
+}
+
 @app.route('/about')
 def about():
-    return render_template('about.html')
+    return conditional_response(*static_pages['/about'])
 
 @app.route('/contacts')
 def contacts():
-    return render_template('contacts.html')
+    return conditional_response(*static_pages['/contacts'])
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0') 
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0')
@@ -0,0 +1,147 @@
+"""End-to-end latency of the bot handlers and the web app on a synthetic league.
+
+Generates a league into a temporary ratings.db, then drives the real lelo_bot
+handlers (reporting a score, confirming a game, /all_stats and its page buttons,
+/my_stats) through Application.process_update with a fake Bot API, and the
+app.home route through the Flask test client. Prints throughput and p50/p99
+latency per path.
+
+Run from the repository root:
+
+    python -m benchmarks.end_to_end --users 10000 --games 1000000 --requests 1000
+"""
+import argparse
+import asyncio
+import os
+import random
+import re
+import tempfile
+import time
+from benchmarks.fake_telegram import FakeTelegramRequest, callback_update, command_update
+from benchmarks.synthetic import create_league, percentile
+
+class BotDriver:
+    """Feeds updates to a bot application one at a time and times each of them."""
+
+    def __init__(self, application, request: FakeTelegramRequest):
+        self.application = application
+        self.request = request
+        self.update_id = 0
+
+    async def send(self, data: dict) -> float:
+        from telegram import Update
+
+        update = Update.de_json(data, self.application.bot)
+        start = time.perf_counter()
+        await self.application.process_update(update)
+        return time.perf_counter() - start
+
+    async def message(self, user_id: int, text: str) -> float:
+        self.update_id += 1
+        return await self.send(command_update(self.update_id, user_id, text))
+
+    async def button(self, user_id: int, data: str) -> float:
+        self.update_id += 1
+        return await self.send(callback_update(self.update_id, user_id, data))
+
+async def bot_paths(driver: BotDriver, users: list, requests: int, rng: random.Random) -> dict:
+    """Return the latencies of every bot path, keyed by path name."""
+    results = {"report_score": [], "confirm_game": [], "all_stats": [], "all_stats page": [], "my_stats": []}
+    pages = max(len(users) // 30, 1)
+
+    for _ in range(requests):
+        (reporter, _), (opponent, opponent_index) = rng.sample(users, 2)
+
+        # Walk the /add_match conversation up to the score, which is the step being timed
+        await driver.message(reporter, "/add_match")
+        await driver.message(reporter, opponent_index)
+        results["report_score"].append(await driver.message(reporter, f"{rng.randint(0, 3)}-{rng.randint(1, 3)}"))
+
+        game_id = next(
+            match.group(1) for _, text in reversed(driver.request.sent)
+            if (match := re.search(r"/confirm_(\d+)", text or ""))
+        )
+        results["confirm_game"].append(await driver.message(opponent, f"/confirm_{game_id}"))
+        assert driver.request.sent[-1][1].startswith("Game confirmed!"), driver.request.sent[-1]
+
+        results["all_stats"].append(await driver.message(reporter, "/all_stats"))
+        results["all_stats page"].append(await driver.button(reporter, f"all_stats:{rng.randint(1, pages)}"))
+        results["my_stats"].append(await driver.message(reporter, "/my_stats"))
+
+        # The fake backend keeps every message; only the latest ones are searched
+        del driver.request.sent[:-10]
+
+    return results
+
+def web_paths(web, requests: int, num_users: int, rng: random.Random) -> dict:
+    """Return the latencies of the home page, rendered, cached and searched."""
+    client = web.app.test_client()
+    pages = max(num_users // web.app.config['PAGE_SIZE'], 1)
+    results = {"home": [], "home (cached)": [], "home search": []}
+
+    # The first request catches up with the bot's writes; keep it out of the samples
+    client.get("/")
+
+    for _ in range(requests):
+        page = rng.randint(1, pages)
+        for path, url in (
+            ("home", f"/?page={page}"),
+            ("home (cached)", f"/?page={page}"),
+            ("home search", f"/?search=Name{rng.randint(1, num_users)}"),
+        ):
+            if path != "home (cached)":
+                web.rendered_pages['pages'].clear()
+            start = time.perf_counter()
+            response = client.get(url)
+            results[path].append(time.perf_counter() - start)
+            assert response.status_code == 200, (url, response.status_code)
+
+    return results
+
+def report(results: dict):
+    print(f"{'path':<16} {'requests':>8} {'per second':>11} {'p50 ms':>8} {'p99 ms':>8}")
+    for path, latencies in results.items():
+        print(f"{path:<16} {len(latencies):>8} {len(latencies) / sum(latencies):>11.0f} "
+              f"{percentile(latencies, 0.50) * 1000:>8.2f} {percentile(latencies, 0.99) * 1000:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "ratings.db")
+        start = time.perf_counter()
+        league = create_league(db_name, args.users, args.games, args.seed)
+        users = [(row[0], row[6]) for row in league.get_users()]
+        league.conn.close()
+        print(f"league: {args.users} users, {args.games} games, generated in {time.perf_counter() - start:.1f} s")
+
+        # The bot and web modules read DATABASE_PATH when they are imported
+        os.environ["DATABASE_PATH"] = db_name
+        os.environ.setdefault("LELO_BOT_TOKEN", "123456:fake-token")
+        start = time.perf_counter()
+        import lelo_bot
+        import app as web
+        print(f"startup: modules imported and leaderboard loaded in {time.perf_counter() - start:.1f} s")
+
+        async def run_bot():
+            request = FakeTelegramRequest()
+            application = lelo_bot.build_application(request)
+            await application.initialize()
+            try:
+                return await bot_paths(BotDriver(application, request), users, args.requests, rng)
+            finally:
+                await application.shutdown()
+
+        results = asyncio.run(run_bot())
+        results.update(web_paths(web, args.requests, args.users, rng))
+
+    report(results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Event-loop lag with the blocking Database versus AsyncDatabase.
+
+Simulates hundreds of concurrent /my_stats and /add_match updates issuing the
+same queries as the lelo_bot handlers, while a ticker task measures how late the
+event loop wakes it up. A background thread plays the other bot and the web app
+by holding write transactions (like a recompute or bulk import), so the bot's
+writes sometimes wait on locks.
+
+Run from the repository root:
+
+    python -m benchmarks.event_loop_lag --updates 500
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import threading
+import time
+from database import Database, AsyncDatabase
+from benchmarks.synthetic import create_league, percentile
+
+TICK = 0.001
+BURST = 20
+
+class BlockingDatabase:
+    """Awaitable facade that calls Database directly on the event loop, like the handlers used to"""
+
+    def __init__(self, db_name: str):
+        self._db = Database(db_name)
+
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+
+        async def call(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return call
+
+def contending_writer(db_name: str, stop: threading.Event, hold: float):
+    db = Database(db_name)
+    while not stop.is_set():
+        db.cursor.execute("BEGIN IMMEDIATE")
+        db.cursor.execute("UPDATE users SET elo = elo WHERE user_id = 1")
+        time.sleep(hold)
+        db.conn.commit()
+        time.sleep(hold * 3)
+
+async def my_stats(db, user_id: int):
+    await db.get_user(user_id)
+    await db.get_rating_history(user_id)
+
+async def add_match(db, user_id: int, opponent_index: str):
+    await db.get_user(user_id)
+    opponent = await db.get_user_by_index(opponent_index)
+    await db.create_game(user_id, opponent[0], 3, 1)
+    await db.get_user(user_id)
+
+async def ticker(stop: asyncio.Event, lags: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+async def run(db, num_users: int, indexes: list, updates: int):
+    stop = asyncio.Event()
+    lags = []
+    tick_task = asyncio.create_task(ticker(stop, lags))
+    rng = random.Random(1)
+
+    # Updates arrive in small bursts, as they would from many chats at once
+    start = time.perf_counter()
+    tasks = []
+    for update in range(updates):
+        user_id = rng.randint(1, num_users)
+        if rng.random() < 0.5:
+            tasks.append(asyncio.create_task(my_stats(db, user_id)))
+        else:
+            tasks.append(asyncio.create_task(add_match(db, user_id, rng.choice(indexes))))
+        if update % BURST == BURST - 1:
+            await asyncio.sleep(TICK)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    await tick_task
+    return elapsed, lags
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--lock-hold", type=float, default=0.05,
+                        help="Seconds the contending writer holds the write lock (0 disables it)")
+    args = parser.parse_args()
+
+    # Keep the database on the working directory's disk so commits pay real I/O costs
+    with tempfile.TemporaryDirectory(dir=".") as tmp:
+        db_name = os.path.join(tmp, "ratings.db")
+        league = create_league(db_name, args.users)
+        indexes = [row[6] for row in league.get_users()]
+        league.conn.close()
+
+        for label, db in (("blocking Database", BlockingDatabase(db_name)), ("AsyncDatabase", AsyncDatabase(db_name))):
+            stop = threading.Event()
+            writer = threading.Thread(target=contending_writer, args=(db_name, stop, args.lock_hold))
+            if args.lock_hold > 0:
+                writer.start()
+            elapsed, lags = asyncio.run(run(db, args.users, indexes, args.updates))
+            stop.set()
+            if writer.is_alive():
+                writer.join()
+            print(f"{label}: {args.updates / elapsed:.0f} updates/s, "
+                  f"loop lag p50 {percentile(lags, 0.50) * 1000:.2f} ms, "
+                  f"p99 {percentile(lags, 0.99) * 1000:.2f} ms, max {max(lags) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
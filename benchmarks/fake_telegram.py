@@ -0,0 +1,91 @@
+"""Offline stand-in for the Telegram Bot API.
+
+FakeTelegramRequest plugs into Application.builder().request(...) and answers
+every Bot API call locally, so the real bot handlers run without network access.
+"""
+import json
+import threading
+import time
+from telegram.request import BaseRequest
+
+def command_update(update_id: int, user_id: int, text: str, chat_id: int = None) -> dict:
+    """Build the JSON of a Telegram update carrying a text message from user_id."""
+    chat_id = user_id if chat_id is None else chat_id
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private" if chat_id == user_id else "supergroup"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+def callback_update(update_id: int, user_id: int, data: str, message_id: int = 1) -> dict:
+    """Build the JSON of a Telegram update for an inline button press on one of the bot's messages."""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "",
+            },
+        },
+    }
+
+class FakeTelegramRequest(BaseRequest):
+    """Answers Bot API calls in-process and records what the bot sent."""
+
+    def __init__(self, on_send=None):
+        self.on_send = on_send
+        self.calls = {}
+        self.sent = []
+        self._message_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def _result(self, endpoint: str, parameters: dict):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if endpoint == "getUpdates":
+            return []
+        if endpoint in ("sendMessage", "editMessageText"):
+            with self._lock:
+                self._message_id += 1
+                message_id = self._message_id
+            chat_id = int(parameters["chat_id"])
+            self.sent.append((chat_id, parameters.get("text")))
+            if self.on_send is not None:
+                self.on_send(chat_id, parameters.get("text"))
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": parameters.get("text"),
+            }
+        return True
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        parameters = request_data.parameters if request_data is not None else {}
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        body = {"ok": True, "result": self._result(endpoint, parameters)}
+        return 200, json.dumps(body).encode()
@@ -0,0 +1,76 @@
+"""Leaderboard latency while the bots write concurrently.
+
+Run from the repository root:
+
+    python -m benchmarks.leaderboard_load --users 10000 --readers 8 --writers 2
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+from database import Database, DatabasePool
+from benchmarks.synthetic import create_league, percentile
+
+def writer(db_name: str, num_users: int, stop: threading.Event, counts: list):
+    # Each writer stands in for a bot process holding its own long-lived connection
+    db = Database(db_name)
+    rng = random.Random()
+    writes = 0
+    while not stop.is_set():
+        # Report and confirm a game the way lelo_bot does
+        player1, player2 = rng.sample(range(1, num_users + 1), 2)
+        game_id = db.create_game(player1, player2, rng.randint(0, 3), rng.randint(1, 3))
+        db.confirm_game_with_ratings(game_id)
+        writes += 1
+    counts.append(writes)
+
+def reader(client, num_pages: int, duration: float, latencies: list):
+    deadline = time.perf_counter() + duration
+    rng = random.Random()
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        response = client.get(f"/?page={rng.randint(1, num_pages)}")
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "ratings.db")
+        create_league(db_name, args.users).conn.close()
+
+        # The web module reads DATABASE_PATH when it is imported
+        os.environ["DATABASE_PATH"] = db_name
+        import app as web
+        web.db_pool = DatabasePool(db_name, size=args.readers)
+
+        stop = threading.Event()
+        writes = []
+        writers = [threading.Thread(target=writer, args=(db_name, args.users, stop, writes)) for _ in range(args.writers)]
+        latencies = []
+        readers = [
+            threading.Thread(target=reader, args=(web.app.test_client(), args.users // 10, args.duration, latencies))
+            for _ in range(args.readers)
+        ]
+
+        for thread in writers + readers:
+            thread.start()
+        for thread in readers:
+            thread.join()
+        stop.set()
+        for thread in writers:
+            thread.join()
+
+    print(f"requests: {len(latencies)} ({len(latencies) / args.duration:.0f}/s), writes: {sum(writes)}")
+    print(f"p50: {percentile(latencies, 0.50) * 1000:.2f} ms, p99: {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""Query plan audit for the hot Database methods.
+
+Runs every hot Database method against a synthetic league, captures the SQL it
+executes and checks EXPLAIN QUERY PLAN for scans of a table or of a whole index. Exits
+with status 1 if a statement scans where ALLOWED_SCANS does not expect it.
+
+Run from the repository root:
+
+    python -m benchmarks.query_plans
+
+benchmarks/test_query_plans.py runs the same audit under pytest.
+"""
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime
+from benchmarks.synthetic import create_league
+
+# Method calls that are expected to scan, with the reason
+ALLOWED_SCANS = {
+    "get_all_users": "returns every user in elo index order",
+    "get_user_rankings": "returns every user in elo index order",
+    "count_users": "COUNT(*) walks the smallest index",
+    "get_admin_titles": "the reconciliation pass reads every admin mapping",
+    "iter_export(users)": "a full export reads every user",
+    "search_users": "reads the top SEARCH_WALK_ROWS entries of idx_users_elo to bound the walk",
+    "search_users(prefix)": "reads the top SEARCH_WALK_ROWS entries of idx_users_elo to bound the walk",
+}
+
+def hot_queries(db):
+    """Return (label, callable) pairs for every query on a hot path."""
+    return [
+        ("get_user", lambda: db.get_user(1)),
+        ("get_user_by_name", lambda: db.get_user_by_name("Name1", "Surname1")),
+        ("get_user_by_index", lambda: db.get_user_by_index("123456")),
+        ("get_all_users", lambda: db.get_all_users()),
+        ("get_user_games", lambda: db.get_user_games(1)),
+        ("get_user_rankings", lambda: db.get_user_rankings()),
+        ("get_rating_history", lambda: db.get_rating_history(1)),
+        ("count_users", lambda: db.count_users()),
+        ("count_users(search)", lambda: db.count_users("Name1")),
+        ("get_leaderboard_page", lambda: db.get_leaderboard_page(10, after=(1500, 100))),
+        ("get_leaderboard_page(search)", lambda: db.get_leaderboard_page(10, "Name1", after=(1500, 100))),
+        ("search_users", lambda: db.search_users("Name12")),
+        ("search_users(prefix)", lambda: db.search_users("Na")),
+        ("iter_confirmed_games", lambda: list(db.iter_confirmed_games())),
+        ("get_admin_titles", lambda: db.get_admin_titles()),
+        ("get_admin_titles(user_ids)", lambda: db.get_admin_titles([1, 2])),
+        ("get_last_game_time", lambda: db.get_last_game_time()),
+        ("get_users_by_indexes", lambda: db.get_users_by_indexes(["123456", "654321"])),
+        ("iter_export(users)", lambda: list(db.iter_export("users"))),
+        ("iter_export(users, since)", lambda: list(db.iter_export("users", 19000))),
+        ("iter_export(games, since)", lambda: list(db.iter_export("games", 19000))),
+        ("get_pending_game", lambda: db.get_pending_game(db.create_game(1, 2, 3, 1))),
+        ("confirm_game_with_ratings", lambda: db.confirm_game_with_ratings(db.create_game(3, 4, 3, 1))),
+        ("delete_expired_games", lambda: db.delete_expired_games(datetime.now())),
+        ("get_rating_changes_since", lambda: db.get_rating_changes_since(0)),
+        ("get_ratings_version", lambda: db.get_ratings_version()),
+        ("import_games", lambda: db.import_games([(5, 6, 3, 1, datetime.now())])),
+    ]
+
+def table_scans(conn, sql: str) -> list:
+    """Return the plan lines of sql that scan a table, directly or through an index."""
+    plan = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    # "SCAN (subquery-N)" reads an already materialized result, not a table,
+    # "SCAN ... VIRTUAL TABLE INDEX" is a lookup in the full-text index, "SCAN CONSTANT ROW"
+    # reads no table and sqlite_sequence holds one row per AUTOINCREMENT table
+    return [
+        row[3] for row in plan
+        if re.match(r"SCAN \w+", row[3]) and "VIRTUAL TABLE INDEX" not in row[3]
+        and row[3] not in ("SCAN CONSTANT ROW", "SCAN sqlite_sequence")
+    ]
+
+def audit(db) -> list:
+    """Run the hot queries on db and return (label, statement, scans) for every unexpected scan."""
+    failures = []
+    for label, query in hot_queries(db):
+        statements = []
+        db.conn.set_trace_callback(statements.append)
+        query()
+        db.conn.set_trace_callback(None)
+
+        for sql in statements:
+            if not sql.lstrip().upper().startswith(("SELECT", "WITH", "UPDATE", "DELETE")):
+                continue
+            scans = table_scans(db.conn, sql)
+            if not scans:
+                print(f"ok    {label}")
+            elif label in ALLOWED_SCANS:
+                print(f"skip  {label}: {', '.join(scans)} ({ALLOWED_SCANS[label]})")
+            else:
+                print(f"FAIL  {label}: {', '.join(scans)}")
+                failures.append((label, sql, scans))
+    return failures
+
+def main():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = create_league(os.path.join(tmp, "ratings.db"), 2000, 20000)
+        db.conn.execute("ANALYZE")
+        failures = audit(db)
+        db.conn.close()
+
+    sys.exit(1 if failures else 0)
+
+if __name__ == '__main__':
+    main()
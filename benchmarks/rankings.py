@@ -0,0 +1,45 @@
+"""Rank computation: correlated COUNT(*) subquery versus RANK() window function.
+
+Run from the repository root:
+
+    python -m benchmarks.rankings --users 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.synthetic import create_league
+
+# The query get_user_rankings used before switching to RANK()
+LEGACY_RANKINGS = """
+    SELECT name, surname, elo, player_index,
+           (SELECT COUNT(*) + 1 FROM users u2 WHERE u2.elo > u1.elo) as rank
+    FROM users u1
+    ORDER BY elo DESC
+"""
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = create_league(os.path.join(tmp, "ratings.db"), args.users)
+
+        window, window_time = timed(db.get_user_rankings)
+        legacy, legacy_time = timed(lambda: db.conn.execute(LEGACY_RANKINGS).fetchall())
+        db.conn.close()
+
+    # Both queries order ties arbitrarily, so compare the ranks per elo value
+    assert sorted((row[2], row[4]) for row in window) == sorted((row[2], row[4]) for row in legacy)
+    print(f"users: {args.users}")
+    print(f"correlated subquery: {legacy_time * 1000:.1f} ms")
+    print(f"RANK() window:       {window_time * 1000:.1f} ms ({legacy_time / window_time:.1f}x faster)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""Typeahead search latency for selective and broad name terms.
+
+Times Database.search_users for every term, from the first keystrokes that match
+most players to terms that match a handful, and checks each result against a
+plain Python filter of all users.
+
+Run from the repository root:
+
+    python -m benchmarks.search --users 100000
+"""
+import argparse
+import os
+import tempfile
+import time
+from benchmarks.synthetic import create_league, percentile
+
+# Prefix terms of one or two characters, then substrings from broad to selective
+TERMS = ["N", "Na", "S", "Su", "urname5", "Name1", "ame12", "Surname123", "Name4321", "Name12345", "Zzz"]
+
+def expected(users: list, search: str, limit: int) -> list:
+    search = search.lower()
+    if len(search) >= 3:
+        matches = [user for user in users if search in f"{user[1]} {user[2]}".lower()]
+    else:
+        matches = [user for user in users if user[1].lower().startswith(search) or user[2].lower().startswith(search)]
+    return sorted(matches, key=lambda user: (-user[3], user[0]))[:limit]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db = create_league(os.path.join(tmp, "ratings.db"), args.users)
+        db.conn.execute("ANALYZE")
+        users = db.conn.execute("SELECT user_id, name, surname, elo FROM users").fetchall()
+
+        print(f"users: {args.users}")
+        print(f"{'term':<12} {'matches':>8} {'p50 ms':>8} {'p99 ms':>8}")
+        for term in TERMS:
+            rows = db.search_users(term, args.limit)
+            assert [row[0] for row in rows] == [user[0] for user in expected(users, term, args.limit)], term
+
+            latencies = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                db.search_users(term, args.limit)
+                latencies.append(time.perf_counter() - start)
+            matches = db.count_users(term)
+            print(f"{term:<12} {matches:>8} {percentile(latencies, 0.50) * 1000:>8.2f} "
+                  f"{percentile(latencies, 0.99) * 1000:>8.2f}")
+        db.conn.close()
+
+if __name__ == '__main__':
+    main()
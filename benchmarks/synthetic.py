@@ -0,0 +1,43 @@
+"""Synthetic league generation shared by the benchmarks."""
+import random
+from datetime import datetime, timedelta
+from database import Database
+
+POSITIONS = ['Student', 'Staff', 'Professor', 'Other']
+
+def create_league(db_name: str, num_users: int, num_games: int = 0, seed: int = 0) -> Database:
+    """Fill db_name with num_users players and num_games confirmed games between them."""
+    rng = random.Random(seed)
+    db = Database(db_name)
+
+    # Sample distinct 6-digit indexes up front instead of registering users one by one
+    indexes = rng.sample(range(100000, 1000000), num_users)
+    db.cursor.executemany(
+        "INSERT INTO users (user_id, name, surname, position, elo, games_played, player_index) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (
+            (user_id, f"Name{user_id}", f"Surname{user_id}", rng.choice(POSITIONS),
+             int(rng.gauss(1500, 150)), 0, str(index))
+            for user_id, index in enumerate(indexes, 1)
+        )
+    )
+
+    start = datetime(2024, 1, 1)
+    def games():
+        for game in range(num_games):
+            player1 = rng.randint(1, num_users)
+            player2 = rng.randint(1, num_users - 1)
+            if player2 >= player1:
+                player2 += 1
+            yield (player1, player2, rng.randint(0, 3), rng.randint(1, 3), start + timedelta(seconds=game), True)
+
+    db.cursor.executemany(
+        "INSERT INTO games (player1_id, player2_id, player1_score, player2_score, timestamp, confirmed) VALUES (?, ?, ?, ?, ?, ?)",
+        games()
+    )
+    db.conn.commit()
+    return db
+
+def percentile(samples, fraction: float) -> float:
+    """Return the given percentile of a list of samples (nearest rank)."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
@@ -0,0 +1,57 @@
+"""The vectorized rating code must match calculate_elo exactly: python -m pytest benchmarks"""
+import random
+import numpy as np
+import pytest
+from elo import calculate_elo, calculate_elo_batch, replay_games
+
+def random_games(rng: random.Random, num_games: int, num_players: int):
+    games = []
+    for _ in range(num_games):
+        player1, player2 = rng.sample(range(num_players), 2)
+        score1 = rng.randint(0, 5)
+        games.append((player1, player2, score1, rng.randint(0 if score1 else 1, 5)))
+    return games
+
+def test_batch_matches_scalar():
+    rng = random.Random(1)
+    ratings1 = [rng.randint(600, 2600) for _ in range(20000)]
+    ratings2 = [rng.randint(600, 2600) for _ in range(20000)]
+    scores = [(score1, rng.randint(0 if score1 else 1, 7)) for score1 in (rng.randint(0, 7) for _ in range(20000))]
+    for k_factor in (16, 32):
+        new1, new2 = calculate_elo_batch(
+            ratings1, ratings2, [s[0] for s in scores], [s[1] for s in scores], k_factor
+        )
+        expected = [
+            calculate_elo(rating1, rating2, score1, score2, k_factor)
+            for rating1, rating2, (score1, score2) in zip(ratings1, ratings2, scores)
+        ]
+        assert list(zip(new1.tolist(), new2.tolist())) == expected
+
+def test_batch_rejects_games_without_points():
+    with pytest.raises(ZeroDivisionError):
+        calculate_elo_batch([1500, 1500], [1500, 1500], [1, 0], [0, 0])
+
+# Few players make rounds narrower than MIN_BATCH_ROUND, rated one game at a time;
+# many players make wide rounds rated with calculate_elo_batch
+@pytest.mark.parametrize("num_players, num_games", [(8, 2000), (5000, 20000)])
+def test_replay_matches_sequential_loop(num_players, num_games):
+    games = random_games(random.Random(num_players), num_games, num_players)
+    players1, players2, scores1, scores2 = (np.array(column, dtype=np.int64) for column in zip(*games))
+
+    ratings, games_played, (before1, before2, after1, after2) = replay_games(
+        players1, players2, scores1, scores2, num_players, 1500, 32
+    )
+
+    expected = [1500] * num_players
+    expected_played = [0] * num_players
+    history = []
+    for player1, player2, score1, score2 in games:
+        new1, new2 = calculate_elo(expected[player1], expected[player2], score1, score2, 32)
+        history.append((expected[player1], expected[player2], new1, new2))
+        expected[player1], expected[player2] = new1, new2
+        expected_played[player1] += 1
+        expected_played[player2] += 1
+
+    assert ratings.tolist() == expected
+    assert games_played.tolist() == expected_played
+    assert list(zip(before1.tolist(), before2.tolist(), after1.tolist(), after2.tolist())) == history
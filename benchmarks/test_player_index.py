@@ -0,0 +1,8 @@
+"""Player indexes come from a permutation of the counter: python -m pytest benchmarks"""
+from database import PLAYER_INDEX_COUNT, permute_player_index
+
+def test_permutation_has_no_collisions():
+    # Every counter value maps into the range and no two share an index
+    key = 0x5DEECE66D
+    values = [permute_player_index(value, key) for value in range(PLAYER_INDEX_COUNT)]
+    assert sorted(values) == list(range(PLAYER_INDEX_COUNT))
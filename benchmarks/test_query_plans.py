@@ -0,0 +1,11 @@
+"""Runs the query plan audit under pytest: python -m pytest benchmarks"""
+from benchmarks.query_plans import audit
+from benchmarks.synthetic import create_league
+
+def test_hot_queries_do_not_scan(tmp_path):
+    db = create_league(str(tmp_path / "ratings.db"), 2000, 20000)
+    db.conn.execute("ANALYZE")
+    try:
+        assert audit(db) == []
+    finally:
+        db.conn.close()
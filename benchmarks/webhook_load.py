@@ -0,0 +1,90 @@
+"""Webhook throughput and end-to-end latency against a fake Telegram backend.
+
+Starts lelo_bot in webhook mode behind a local HTTP server, fires /my_stats
+updates at a fixed rate and measures the time from POSTing each update until the
+bot's reply reaches the fake Bot API.
+
+Run from the repository root:
+
+    python -m benchmarks.webhook_load --rate 200 --duration 5
+"""
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from werkzeug.serving import make_server
+from benchmarks.fake_telegram import FakeTelegramRequest, command_update
+from benchmarks.synthetic import create_league, percentile
+
+SECRET = "benchmark-secret"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--rate", type=int, default=200, help="Updates per second")
+    parser.add_argument("--duration", type=float, default=5.0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "ratings.db")
+        create_league(db_name, args.users).conn.close()
+        os.environ["DATABASE_PATH"] = db_name
+        os.environ.setdefault("LELO_BOT_TOKEN", "123456:fake-token")
+
+        # The bot modules read DATABASE_PATH when they are imported
+        import lelo_bot
+        import webhook
+
+        sent_at = {}
+        latencies = []
+
+        def on_send(chat_id, text):
+            start = sent_at.pop(chat_id, None)
+            if start is not None:
+                latencies.append(time.perf_counter() - start)
+
+        application = lelo_bot.build_application(FakeTelegramRequest(on_send))
+        loop = webhook.start_application("lelo", application)
+        server_app = Flask("webhook_load")
+        server_app.register_blueprint(webhook.telegram_blueprint("lelo", application, loop, SECRET))
+        server = make_server("127.0.0.1", 0, server_app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = f"http://127.0.0.1:{server.server_port}{webhook.webhook_path('lelo')}"
+
+        def post(update_id: int):
+            # Cycle through users so each chat has at most one update in flight
+            user_id = update_id % args.users + 1
+            body = json.dumps(command_update(update_id, user_id, "/my_stats")).encode()
+            request = urllib.request.Request(url, body, {
+                "Content-Type": "application/json",
+                "X-Telegram-Bot-Api-Secret-Token": SECRET,
+            })
+            sent_at[user_id] = time.perf_counter()
+            urllib.request.urlopen(request).read()
+
+        total = int(args.rate * args.duration)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=32) as pool:
+            for update_id in range(total):
+                # Pace submissions to the requested rate
+                delay = start + update_id / args.rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(post, update_id)
+
+        deadline = time.perf_counter() + 10
+        while len(latencies) < total and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+
+    print(f"updates: {total}, replies: {len(latencies)} ({len(latencies) / elapsed:.0f}/s)")
+    print(f"end-to-end p50: {percentile(latencies, 0.50) * 1000:.2f} ms, p99: {percentile(latencies, 0.99) * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,59 @@
 import sqlite3
 from datetime import datetime
-import random
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
+import functools
+import hashlib
+import numpy as np
+import queue
+import secrets
+import threading
+from elo import calculate_elo, rate_games
+from metrics import DATABASE_SECONDS, timed_methods
 
+# Memory-map up to 256 MB of the database file for reads
+MMAP_SIZE = 256 * 1024 * 1024
+
+# Player indexes are the 6-digit numbers 100000-999999
+PLAYER_INDEX_BASE = 100000
+PLAYER_INDEX_COUNT = 900000
+FEISTEL_RADIX = 1000
+FEISTEL_ROUNDS = 4
+
+def permute_player_index(value: int, key: int) -> int:
+    """Map 0 <= value < PLAYER_INDEX_COUNT to a distinct, scattered number in the same range.
+    
+    A keyed Feistel network permutes [0, FEISTEL_RADIX ** 2); results beyond the range
+    are fed back in (cycle walking), which keeps the mapping a permutation of the range.
+    """
+    key_bytes = key.to_bytes(8, 'big')
+    while True:
+        left, right = divmod(value, FEISTEL_RADIX)
+        for round_number in range(FEISTEL_ROUNDS):
+            digest = hashlib.blake2b(f"{round_number}:{right}".encode(), key=key_bytes, digest_size=4).digest()
+            left, right = right, (left + int.from_bytes(digest, 'big')) % FEISTEL_RADIX
+        value = left * FEISTEL_RADIX + right
+        if value < PLAYER_INDEX_COUNT:
+            return value
+
+@timed_methods(DATABASE_SECONDS)
 class Database:
-    def __init__(self, db_name="ratings.db"):
-        self.conn = sqlite3.connect(db_name)
+    def __init__(self, db_name="ratings.db", check_same_thread=True, row_factory=None):
+        self.conn = sqlite3.connect(db_name, timeout=10, check_same_thread=check_same_thread)
+        self.conn.row_factory = row_factory
+        self.configure_connection()
         self.cursor = self.conn.cursor()
         self.setup_database()
     
+    def configure_connection(self):
+        # WAL lets the web app read while the bots write; NORMAL sync is durable across
+        # application crashes and only fsyncs the WAL on checkpoints
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+        self.conn.execute("PRAGMA busy_timeout = 10000")
+    
     def setup_database(self):
         # Create users table with player_index column
         self.cursor.execute('''
@@ -36,26 +82,138 @@ class Database:
                 FOREIGN KEY (player2_id) REFERENCES users (user_id)
             )
         ''')
+        
+        # Create rating history table with each player's ELO before and after a confirmed game
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS rating_history (
+                history_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                game_id INTEGER,
+                user_id INTEGER,
+                elo_before INTEGER,
+                elo_after INTEGER,
+                timestamp DATETIME,
+                FOREIGN KEY (game_id) REFERENCES games (game_id),
+                FOREIGN KEY (user_id) REFERENCES users (user_id)
+            )
+        ''')
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_rating_history_user ON rating_history (user_id, timestamp)"
+        )
+        
+        # Create admin mappings table: the player whose ELO each group admin shows as a title,
+        # and the title last set in Telegram
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS admin_mappings (
+                chat_id INTEGER,
+                user_id INTEGER,
+                player_index TEXT,
+                applied_title TEXT,
+                PRIMARY KEY (chat_id, user_id)
+            )
+        ''')
+        self.cursor.execute("PRAGMA table_info(admin_mappings)")
+        if 'applied_title' not in [column[1] for column in self.cursor.fetchall()]:
+            self.cursor.execute("ALTER TABLE admin_mappings ADD COLUMN applied_title TEXT")
+        self.cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_admin_mappings_player ON admin_mappings (player_index)"
+        )
+        
+        # Counter behind player index allocation, with the key that scatters its values
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS player_index_allocator (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                next_value INTEGER NOT NULL,
+                key INTEGER NOT NULL
+            )
+        ''')
+        self.cursor.execute(
+            "INSERT OR IGNORE INTO player_index_allocator (id, next_value, key) VALUES (1, 0, ?)",
+            (secrets.randbits(63),)
+        )
+        
+        # Bumped whenever ratings are rewritten wholesale, telling in-memory copies to reload
+        self.cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ratings_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version INTEGER NOT NULL
+            )
+        ''')
+        self.cursor.execute("INSERT OR IGNORE INTO ratings_version (id, version) VALUES (1, 0)")
+        
+        # Secondary indexes for the lookups and orderings used by the bots and the web app
+        self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_users_player_index ON users (player_index)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users (name, surname)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_elo ON users (elo)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_player1 ON games (player1_id, confirmed, timestamp)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_player2 ON games (player2_id, confirmed, timestamp)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_games_confirmed ON games (confirmed, timestamp)")
+        
+        # Case-insensitive prefix lookups for search terms too short for trigrams
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_name_nocase ON users (name COLLATE NOCASE)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_surname_nocase ON users (surname COLLATE NOCASE)")
+        
+        self.setup_search_index()
         self.conn.commit()
     
-    def generate_unique_index(self):
-        """Generate a unique 6-digit index that doesn't exist in the database yet"""
+    def setup_search_index(self):
+        # Trigram full-text index over "name surname" for substring search, kept in sync by triggers
+        self.cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'users_fts'")
+        exists = self.cursor.fetchone()[0]
+        self.cursor.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(full_name, tokenize = 'trigram')"
+        )
+        if not exists:
+            self.cursor.execute(
+                "INSERT INTO users_fts (rowid, full_name) SELECT user_id, name || ' ' || surname FROM users"
+            )
+        
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users BEGIN
+                INSERT INTO users_fts (rowid, full_name) VALUES (new.user_id, new.name || ' ' || new.surname);
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users BEGIN
+                DELETE FROM users_fts WHERE rowid = old.user_id;
+            END
+        ''')
+        self.cursor.execute('''
+            CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF name, surname ON users BEGIN
+                UPDATE users_fts SET full_name = new.name || ' ' || new.surname WHERE rowid = old.user_id;
+            END
+        ''')
+    
+    def allocate_player_index(self) -> str:
+        """Take the next unused 6-digit player index; call inside a write transaction.
+        
+        Indexes come from a permutation of an increasing counter, so they never repeat
+        and do not reveal registration order. Only indexes handed out randomly before
+        the allocator existed can be skipped over.
+        """
         while True:
-            # Generate a random 6-digit number
-            index = str(random.randint(100000, 999999))
+            self.cursor.execute("SELECT next_value, key FROM player_index_allocator WHERE id = 1")
+            value, key = self.cursor.fetchone()
+            if value >= PLAYER_INDEX_COUNT:
+                raise RuntimeError("All player indexes are taken")
+            self.cursor.execute("UPDATE player_index_allocator SET next_value = next_value + 1 WHERE id = 1")
             
-            # Check if this index already exists
-            self.cursor.execute("SELECT COUNT(*) FROM users WHERE player_index = ?", (index,))
-            count = self.cursor.fetchone()[0]
-            
-            # If index doesn't exist, return it
-            if count == 0:
+            index = str(PLAYER_INDEX_BASE + permute_player_index(value, key))
+            self.cursor.execute("SELECT 1 FROM users WHERE player_index = ?", (index,))
+            if self.cursor.fetchone() is None:
                 return index
     
     def register_user(self, user_id: int, name: str, surname: str, position: str) -> bool:
         try:
+            # The write lock keeps other processes from allocating the same index meanwhile;
+            # the unique index on player_index would reject it anyway
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+            if self.cursor.fetchone() is not None:
+                self.conn.rollback()
+                return False
+            
             # Generate a unique 6-digit index for the player
-            player_index = self.generate_unique_index()
+            player_index = self.allocate_player_index()
             
             self.cursor.execute(
                 "INSERT INTO users (user_id, name, surname, position, player_index) VALUES (?, ?, ?, ?, ?)",
@@ -64,7 +222,11 @@ class Database:
             self.conn.commit()
             return True
         except sqlite3.IntegrityError:
+            self.conn.rollback()
             return False
+        except Exception:
+            self.conn.rollback()
+            raise
     
     def get_user(self, user_id: int):
         self.cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
@@ -102,14 +264,455 @@ class Database:
         )
         self.conn.commit()
     
+    def confirm_game_with_ratings(self, game_id: int):
+        """Confirm a pending game and apply both players' new ratings in one transaction.
+        
+        Returns (player1, player2, updated1, updated2) with the players' rows as they were
+        before and after the game, or None if the game does not exist or is already confirmed.
+        """
+        try:
+            # Take the write lock up front so the ratings read below cannot change underneath
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute(
+                "SELECT player1_id, player2_id, player1_score, player2_score FROM games WHERE game_id = ? AND confirmed = FALSE",
+                (game_id,)
+            )
+            game = self.cursor.fetchone()
+            if not game:
+                self.conn.rollback()
+                return None
+            player1_id, player2_id, score1, score2 = game
+            
+            self.cursor.execute("SELECT * FROM users WHERE user_id IN (?, ?)", (player1_id, player2_id))
+            players = {row[0]: row for row in self.cursor.fetchall()}
+            player1, player2 = players[player1_id], players[player2_id]
+            new_rating1, new_rating2 = calculate_elo(player1[4], player2[4], score1, score2)
+            
+            now = datetime.now()
+            self.cursor.execute("UPDATE games SET confirmed = TRUE WHERE game_id = ?", (game_id,))
+            self.cursor.executemany(
+                "UPDATE users SET elo = ?, games_played = games_played + 1 WHERE user_id = ?",
+                [(new_rating1, player1_id), (new_rating2, player2_id)]
+            )
+            self.cursor.executemany(
+                "INSERT INTO rating_history (game_id, user_id, elo_before, elo_after, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [(game_id, player1_id, player1[4], new_rating1, now), (game_id, player2_id, player2[4], new_rating2, now)]
+            )
+            self.cursor.execute("SELECT * FROM users WHERE user_id IN (?, ?)", (player1_id, player2_id))
+            updated = {row[0]: row for row in self.cursor.fetchall()}
+            self.conn.commit()
+            return player1, player2, updated[player1_id], updated[player2_id]
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def import_games(self, games, k_factor: int = 32, dry_run: bool = False):
+        """Insert already played games as confirmed and apply their ratings, in one transaction.
+        
+        games are (player1_id, player2_id, player1_score, player2_score, timestamp) in playing
+        order; they are rated on top of the current ratings, one round of independent games
+        at a time. Returns (game_id, player1_id, player2_id, elo_before1, elo_after1,
+        elo_before2, elo_after2) per game; with dry_run the transaction is rolled back.
+        """
+        games = list(games)
+        if not games:
+            return []
+        try:
+            # Ratings are read under the write lock so no confirmation can interleave
+            self.cursor.execute("BEGIN IMMEDIATE")
+            user_ids = sorted({player_id for game in games for player_id in game[:2]})
+            placeholders = ", ".join("?" * len(user_ids))
+            self.cursor.execute(f"SELECT user_id, elo FROM users WHERE user_id IN ({placeholders})", user_ids)
+            ratings = dict(self.cursor.fetchall())
+            missing = [user_id for user_id in user_ids if user_id not in ratings]
+            if missing:
+                raise LookupError(f"Unknown users: {missing}")
+            
+            positions = {user_id: position for position, user_id in enumerate(user_ids)}
+            elos = np.array([ratings[user_id] for user_id in user_ids], dtype=np.int64)
+            before1, before2, after1, after2 = rate_games(
+                [positions[game[0]] for game in games], [positions[game[1]] for game in games],
+                [game[2] for game in games], [game[3] for game in games], elos, k_factor
+            )
+            
+            # Number the games explicitly so the history rows can refer to them
+            self.cursor.execute("""
+                SELECT MAX(COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'games'), 0),
+                           COALESCE((SELECT MAX(game_id) FROM games), 0))
+            """)
+            first_game_id = self.cursor.fetchone()[0] + 1
+            game_ids = range(first_game_id, first_game_id + len(games))
+            
+            self.cursor.executemany(
+                "INSERT INTO games (game_id, player1_id, player2_id, player1_score, player2_score, timestamp, confirmed) VALUES (?, ?, ?, ?, ?, ?, TRUE)",
+                [(game_id,) + tuple(game) for game_id, game in zip(game_ids, games)]
+            )
+            games_played = {}
+            for game in games:
+                games_played[game[0]] = games_played.get(game[0], 0) + 1
+                games_played[game[1]] = games_played.get(game[1], 0) + 1
+            self.cursor.executemany(
+                "UPDATE users SET elo = ?, games_played = games_played + ? WHERE user_id = ?",
+                [(elos.item(positions[user_id]), count, user_id) for user_id, count in games_played.items()]
+            )
+            
+            results = [
+                (game_id, game[0], game[1], elo_before1, elo_after1, elo_before2, elo_after2)
+                for game_id, game, elo_before1, elo_after1, elo_before2, elo_after2 in zip(
+                    game_ids, games, before1.tolist(), after1.tolist(), before2.tolist(), after2.tolist()
+                )
+            ]
+            # History rows carry the time each game was played, not the time of the import
+            self.cursor.executemany(
+                "INSERT INTO rating_history (game_id, user_id, elo_before, elo_after, timestamp) VALUES (?, ?, ?, ?, ?)",
+                [
+                    row
+                    for (game_id, player1_id, player2_id, elo_before1, elo_after1, elo_before2, elo_after2), game
+                    in zip(results, games)
+                    for row in ((game_id, player1_id, elo_before1, elo_after1, game[4]),
+                                (game_id, player2_id, elo_before2, elo_after2, game[4]))
+                ]
+            )
+            if dry_run:
+                self.conn.rollback()
+            else:
+                self.conn.commit()
+            return results
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def get_last_game_time(self):
+        """Return when the latest confirmed game was played, or None without games"""
+        self.cursor.execute("SELECT MAX(timestamp) FROM games WHERE confirmed = TRUE")
+        timestamp = self.cursor.fetchone()[0]
+        return datetime.fromisoformat(timestamp) if timestamp else None
+    
+    def get_rating_history(self, user_id: int, limit: int = 10):
+        """Return the user's latest rating changes, oldest first"""
+        self.cursor.execute("""
+            SELECT game_id, elo_before, elo_after, timestamp
+            FROM rating_history
+            WHERE user_id = ?
+            ORDER BY timestamp DESC, history_id DESC
+            LIMIT ?
+        """, (user_id, limit))
+        return self.cursor.fetchall()[::-1]
+    
     def delete_game(self, game_id: int):
         self.cursor.execute("DELETE FROM games WHERE game_id = ?", (game_id,))
         self.conn.commit()
     
+    def get_pending_game(self, game_id: int):
+        self.cursor.execute(
+            "SELECT player1_id, player2_id, player1_score, player2_score, timestamp FROM games WHERE game_id = ? AND confirmed = FALSE",
+            (game_id,)
+        )
+        return self.cursor.fetchone()
+    
+    def delete_pending_game(self, game_id: int) -> bool:
+        """Delete a game unless it was confirmed meanwhile, returning whether it was deleted"""
+        self.cursor.execute("DELETE FROM games WHERE game_id = ? AND confirmed = FALSE", (game_id,))
+        self.conn.commit()
+        return self.cursor.rowcount > 0
+    
+    def delete_expired_games(self, cutoff: datetime, limit: int = 500):
+        """Delete up to limit unconfirmed games reported before cutoff and return their ids"""
+        try:
+            # Hold the write lock so no game selected here can be confirmed before it is deleted
+            self.cursor.execute("BEGIN IMMEDIATE")
+            self.cursor.execute(
+                "SELECT game_id FROM games WHERE confirmed = FALSE AND timestamp < ? LIMIT ?",
+                (cutoff, limit)
+            )
+            game_ids = [row[0] for row in self.cursor.fetchall()]
+            self.cursor.executemany(
+                "DELETE FROM games WHERE game_id = ? AND confirmed = FALSE",
+                [(game_id,) for game_id in game_ids]
+            )
+            self.conn.commit()
+            return game_ids
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+    
+    def iter_confirmed_games(self, batch_size: int = 50000):
+        """Yield confirmed games in play order as batches of (player1_id, player2_id, player1_score, player2_score, game_id)"""
+        # Use a dedicated cursor so other queries can run while the stream is consumed
+        cursor = self.conn.cursor()
+        cursor.execute("""
+            SELECT player1_id, player2_id, player1_score, player2_score, game_id
+            FROM games
+            WHERE confirmed = TRUE
+            ORDER BY timestamp, game_id
+        """)
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    
+    # Columns of the users and games exports, in output order
+    EXPORT_COLUMNS = {
+        'users': ('user_id', 'name', 'surname', 'position', 'elo', 'games_played', 'player_index'),
+        'games': ('game_id', 'player1_id', 'player2_id', 'player1_score', 'player2_score', 'timestamp'),
+    }
+    
+    def iter_export(self, table: str, since_game_id: int = 0, batch_size: int = 1000):
+        """Yield the rows of a users or games export in batches, streamed from one cursor.
+        
+        Only confirmed games with game_id > since_game_id are exported; with since_game_id
+        set, users are limited to the players of those games.
+        """
+        columns = ", ".join(self.EXPORT_COLUMNS[table])
+        cursor = self.conn.cursor()
+        if table == 'games':
+            cursor.execute(f"""
+                SELECT {columns} FROM games
+                WHERE game_id > ? AND confirmed = TRUE
+                ORDER BY game_id
+            """, (since_game_id,))
+        elif since_game_id:
+            cursor.execute(f"""
+                SELECT {columns} FROM users
+                WHERE user_id IN (
+                    SELECT player1_id FROM games WHERE game_id > ? AND confirmed = TRUE
+                    UNION
+                    SELECT player2_id FROM games WHERE game_id > ? AND confirmed = TRUE
+                )
+                ORDER BY user_id
+            """, (since_game_id, since_game_id))
+        else:
+            cursor.execute(f"SELECT {columns} FROM users ORDER BY user_id")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+    
+    def begin_write(self):
+        """Take the write lock now; it is held until the next commit or rollback"""
+        self.cursor.execute("BEGIN IMMEDIATE")
+    
+    def get_all_ratings(self):
+        self.cursor.execute("SELECT user_id, name, surname, elo, games_played FROM users ORDER BY user_id")
+        return self.cursor.fetchall()
+    
+    def set_all_ratings(self, ratings, history):
+        """Overwrite elo and games_played for many users and rewrite the rating history, in one transaction.
+        
+        ratings are (elo, games_played, user_id); history is (game_id, user_id, elo_before, elo_after)
+        for both players of every rated game and replaces the whole rating_history table, stamped
+        with the games' times. The ratings version is bumped so in-memory copies reload.
+        """
+        try:
+            self.cursor.executemany("UPDATE users SET elo = ?, games_played = ? WHERE user_id = ?", ratings)
+            self.cursor.execute("DELETE FROM rating_history")
+            self.cursor.executemany(
+                """
+                INSERT INTO rating_history (game_id, user_id, elo_before, elo_after, timestamp)
+                SELECT game_id, ?, ?, ?, timestamp FROM games WHERE game_id = ?
+                """,
+                ((user_id, elo_before, elo_after, game_id) for game_id, user_id, elo_before, elo_after in history)
+            )
+            self.cursor.execute("UPDATE ratings_version SET version = version + 1 WHERE id = 1")
+            self.conn.commit()
+        except sqlite3.Error:
+            self.conn.rollback()
+            raise
+    
+    # Ids bound per IN (...) query, well below SQLite's limit on host parameters
+    MAX_QUERY_IDS = 500
+    
+    def get_users(self, user_ids=None):
+        """Return full users rows, for all users or only the given ids"""
+        if user_ids is None:
+            self.cursor.execute("SELECT * FROM users")
+            return self.cursor.fetchall()
+        
+        user_ids = list(user_ids)
+        rows = []
+        for start in range(0, len(user_ids), self.MAX_QUERY_IDS):
+            chunk = user_ids[start:start + self.MAX_QUERY_IDS]
+            placeholders = ", ".join("?" * len(chunk))
+            self.cursor.execute(f"SELECT * FROM users WHERE user_id IN ({placeholders})", chunk)
+            rows.extend(self.cursor.fetchall())
+        return rows
+    
+    def get_data_version(self):
+        # Changes whenever another connection commits to the database
+        self.cursor.execute("PRAGMA data_version")
+        return self.cursor.fetchone()[0]
+    
+    def get_ratings_version(self):
+        self.cursor.execute("SELECT version FROM ratings_version WHERE id = 1")
+        return self.cursor.fetchone()[0]
+    
+    def get_last_history_id(self):
+        self.cursor.execute("SELECT COALESCE(MAX(history_id), 0) FROM rating_history")
+        return self.cursor.fetchone()[0]
+    
+    def get_rating_changes_since(self, history_id: int):
+        self.cursor.execute(
+            "SELECT history_id, user_id FROM rating_history WHERE history_id > ? ORDER BY history_id",
+            (history_id,)
+        )
+        return self.cursor.fetchall()
+    
+    # Trigram indexes only match terms of at least three characters
+    MIN_SUBSTRING_SEARCH = 3
+    
+    # Top rated users a typeahead search checks one by one before using the search indexes
+    SEARCH_WALK_ROWS = 200
+    
+    def _search_condition(self, search: str, per_row: bool = False):
+        """Return an SQL condition on users and its parameters matching a name search.
+        
+        With per_row the condition is checked on each row instead of selecting rows
+        through the search indexes, for walking users in another index's order.
+        """
+        if len(search) >= self.MIN_SUBSTRING_SEARCH:
+            if per_row:
+                return "name || ' ' || surname LIKE ?", [f'%{search}%']
+            # Substring anywhere in "name surname", served by the trigram index
+            return "user_id IN (SELECT rowid FROM users_fts WHERE full_name LIKE ?)", [f'%{search}%']
+        # Shorter terms match the start of the name or surname through the NOCASE indexes
+        return "(name LIKE ? OR surname LIKE ?)", [f'{search}%', f'{search}%']
+    
+    def count_users(self, search: str = ''):
+        if search:
+            condition, params = self._search_condition(search)
+            self.cursor.execute(f"SELECT COUNT(*) FROM users WHERE {condition}", params)
+        else:
+            self.cursor.execute("SELECT COUNT(*) FROM users")
+        return self.cursor.fetchone()[0]
+    
+    def search_users(self, search: str, limit: int = 10):
+        """Return the highest rated users matching a name search, for typeahead"""
+        # Broad terms, like the first keystrokes, have enough matches among the top rated users:
+        # walk idx_users_elo from the top and stop at the limit instead of sorting every match
+        self.cursor.execute("SELECT elo FROM users ORDER BY elo DESC LIMIT 1 OFFSET ?", (self.SEARCH_WALK_ROWS,))
+        floor = self.cursor.fetchone()
+        condition, params = self._search_condition(search, per_row=True)
+        if floor is not None:
+            condition += " AND elo >= ?"
+            params.append(floor[0])
+        self.cursor.execute(f"""
+            SELECT user_id, name, surname, elo, games_played, player_index
+            FROM users INDEXED BY idx_users_elo
+            WHERE {condition}
+            ORDER BY elo DESC, user_id ASC LIMIT ?
+        """, params + [limit])
+        rows = self.cursor.fetchall()
+        if len(rows) == limit or floor is None:
+            return rows
+        
+        # Selective terms are found through the search indexes, and only their matches sorted
+        condition, params = self._search_condition(search)
+        self.cursor.execute(f"""
+            SELECT user_id, name, surname, elo, games_played, player_index
+            FROM users
+            WHERE {condition}
+            ORDER BY elo DESC, user_id ASC LIMIT ?
+        """, params + [limit])
+        return self.cursor.fetchall()
+    
+    def get_leaderboard_page(self, limit: int = 10, search: str = '', after=None, before=None, offset: int = 0):
+        """Return a page of users ordered by elo (highest first), ties by user_id.
+        
+        after and before are (elo, user_id) cursors of the last row of the previous page
+        or the first row of the next page; without a cursor the page starts at offset.
+        """
+        conditions = []
+        params = []
+        if search:
+            condition, search_params = self._search_condition(search)
+            conditions.append(condition)
+            params.extend(search_params)
+        if after is not None:
+            conditions.append("(elo < ? OR (elo = ? AND user_id > ?))")
+            params.extend([after[0], after[0], after[1]])
+        elif before is not None:
+            conditions.append("(elo > ? OR (elo = ? AND user_id < ?))")
+            params.extend([before[0], before[0], before[1]])
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        # Seeking backwards reads the rows just above the cursor in reverse order
+        backwards = after is None and before is not None
+        order = "elo ASC, user_id DESC" if backwards else "elo DESC, user_id ASC"
+        if after is not None or before is not None:
+            offset = 0
+        
+        self.cursor.execute(f"""
+            SELECT user_id, name, surname, elo, games_played, player_index
+            FROM users
+            {where}
+            ORDER BY {order} LIMIT ? OFFSET ?
+        """, params + [limit, offset])
+        rows = self.cursor.fetchall()
+        return rows[::-1] if backwards else rows
+    
     def get_user_by_index(self, player_index: str):
         self.cursor.execute("SELECT * FROM users WHERE player_index = ?", (player_index,))
         return self.cursor.fetchone()
     
+    def get_users_by_indexes(self, player_indexes):
+        """Return full users rows for many player indexes in one query"""
+        player_indexes = list(player_indexes)
+        if not player_indexes:
+            return []
+        placeholders = ", ".join("?" * len(player_indexes))
+        self.cursor.execute(f"SELECT * FROM users WHERE player_index IN ({placeholders})", player_indexes)
+        return self.cursor.fetchall()
+    
+    def set_admin_mapping(self, chat_id: int, user_id: int, player_index: str, applied_title: str = None):
+        self.cursor.execute("""
+            INSERT INTO admin_mappings (chat_id, user_id, player_index, applied_title) VALUES (?, ?, ?, ?)
+            ON CONFLICT (chat_id, user_id) DO UPDATE
+            SET player_index = excluded.player_index, applied_title = excluded.applied_title
+        """, (chat_id, user_id, player_index, applied_title))
+        self.conn.commit()
+    
+    def set_applied_titles(self, titles):
+        """Record (applied_title, chat_id, user_id) for titles just set in Telegram"""
+        self.cursor.executemany(
+            "UPDATE admin_mappings SET applied_title = ? WHERE chat_id = ? AND user_id = ?", titles
+        )
+        self.conn.commit()
+    
+    def import_admin_mappings(self, mappings):
+        """Upsert many (chat_id, user_id, player_index) mappings in one transaction"""
+        self.cursor.executemany("""
+            INSERT INTO admin_mappings (chat_id, user_id, player_index) VALUES (?, ?, ?)
+            ON CONFLICT (chat_id, user_id) DO UPDATE SET player_index = excluded.player_index
+        """, mappings)
+        self.conn.commit()
+    
+    def get_admin_titles(self, user_ids=None):
+        """Return (chat_id, user_id, player_index, elo, applied_title) for every admin mapping,
+        or for the mappings of the given players; elo is None if the player no longer exists"""
+        if user_ids is None:
+            self.cursor.execute("""
+                SELECT m.chat_id, m.user_id, m.player_index, u.elo, m.applied_title
+                FROM admin_mappings m
+                LEFT JOIN users u ON u.player_index = m.player_index
+            """)
+            return self.cursor.fetchall()
+        
+        user_ids = list(user_ids)
+        rows = []
+        for start in range(0, len(user_ids), self.MAX_QUERY_IDS):
+            chunk = user_ids[start:start + self.MAX_QUERY_IDS]
+            placeholders = ", ".join("?" * len(chunk))
+            self.cursor.execute(f"""
+                SELECT m.chat_id, m.user_id, m.player_index, u.elo, m.applied_title
+                FROM users u
+                JOIN admin_mappings m ON m.player_index = u.player_index
+                WHERE u.user_id IN ({placeholders})
+            """, chunk)
+            rows.extend(self.cursor.fetchall())
+        return rows
+    
     # Add a method to get user's match history
     def get_user_games(self, user_id: int, limit: int = 10):
         self.cursor.execute("""
@@ -127,11 +730,81 @@ class Database:
         return self.cursor.fetchall()
     
     # Add a method to get user rankings with position
+    # RANK() gives tied players the same rank and skips the following ranks
     def get_user_rankings(self):
         self.cursor.execute("""
             SELECT name, surname, elo, player_index,
-                   (SELECT COUNT(*) + 1 FROM users u2 WHERE u2.elo > u1.elo) as rank
-            FROM users u1
+                   RANK() OVER (ORDER BY elo DESC) as rank
+            FROM users
             ORDER BY elo DESC
         """)
-        return self.cursor.fetchall() 
\ No newline at end of file
+        return self.cursor.fetchall() 
+
+class DatabasePool:
+    """Thread-safe pool of Database instances for multi-threaded readers such as the Flask app"""
+    
+    def __init__(self, db_name="ratings.db", size: int = 8):
+        self.db_name = db_name
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+    
+    @contextmanager
+    def acquire(self):
+        """Borrow a Database for the duration of a with block"""
+        try:
+            db = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                create = self._created < self.size
+                if create:
+                    self._created += 1
+            # Connections are opened lazily up to size, after that callers wait for a free one
+            if create:
+                try:
+                    db = Database(self.db_name, check_same_thread=False, row_factory=sqlite3.Row)
+                except sqlite3.Error:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+            else:
+                db = self._idle.get()
+        try:
+            yield db
+        finally:
+            if db.conn.in_transaction:
+                db.conn.rollback()
+            self._idle.put(db)
+
+class AsyncDatabase:
+    """Awaitable Database API for the asyncio bots.
+    
+    Every call runs on one dedicated thread that owns the connection, so SQLite work
+    and commits never block the event loop and writes stay serialized.
+    """
+    
+    def __init__(self, db_name="ratings.db"):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+        self._db = self._executor.submit(Database, db_name).result()
+    
+    def run_sync(self, func, *args):
+        """Run func(db, *args) on the database thread and block until it finishes, for startup code"""
+        return self._executor.submit(func, self._db, *args).result()
+    
+    async def run(self, func, *args):
+        """Run func(db, *args) on the database thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, self._db, *args)
+    
+    def __getattr__(self, name):
+        method = getattr(self._db, name)
+        if not callable(method):
+            raise AttributeError(name)
+        
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(method, *args, **kwargs))
+        
+        call.__name__ = name
+        return call
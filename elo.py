@@ -17,4 +17,143 @@ def calculate_elo(rating1: int, rating2: int, score1: int, score2: int, k_factor
     new_rating1 = round(rating1 + k_factor * (actual_score1 - expected_score1) * multiplier)
     new_rating2 = round(rating2 + k_factor * (actual_score2 - expected_score2) * multiplier)
     
-    return new_rating1, new_rating2 
\ No newline at end of file
+    return new_rating1, new_rating2 
+
+def _lookup(values: np.ndarray, func) -> np.ndarray:
+    """Apply a scalar function to every distinct value of an integer array."""
+    # Ratings and scores are integers with few distinct values, so evaluating the
+    # transcendental parts once per distinct value through the exact scalar code path
+    # keeps results bit-identical to calculate_elo (SIMD ufuncs may differ by an ulp)
+    unique, inverse = np.unique(values, return_inverse=True)
+    table = np.array([func(value) for value in unique.tolist()], dtype=np.float64)
+    return table[inverse.reshape(values.shape)]
+
+def score_multiplier(score1, score2) -> np.ndarray:
+    """Calculate the 4/pi * arctan(total_score) multiplier for arrays of scores."""
+    total_score = np.asarray(score1, dtype=np.int64) + np.asarray(score2, dtype=np.int64)
+    return _lookup(total_score, lambda total: 4/np.pi * np.arctan(total))
+
+def calculate_elo_batch(ratings1, ratings2, scores1, scores2, k_factor: int = 32,
+                        multiplier=None) -> tuple[np.ndarray, np.ndarray]:
+    """Calculate new ELO ratings for arrays of games, identical to calculate_elo per element."""
+    ratings1 = np.asarray(ratings1, dtype=np.int64)
+    ratings2 = np.asarray(ratings2, dtype=np.int64)
+    scores1 = np.asarray(scores1, dtype=np.int64)
+    scores2 = np.asarray(scores2, dtype=np.int64)
+
+    total_score = scores1 + scores2
+    # NumPy would turn 0/0 into NaN and then a garbage rating instead of raising
+    if not np.all(total_score > 0):
+        raise ZeroDivisionError("a game needs a positive total score")
+    if multiplier is None:
+        multiplier = score_multiplier(scores1, scores2)
+
+    actual_score1 = scores1 / total_score
+    actual_score2 = scores2 / total_score
+
+    # Calculate expected scores
+    diff = ratings2 - ratings1
+    expected_score1 = 1 / (1 + _lookup(diff, lambda d: 10 ** (d / 400)))
+    expected_score2 = 1 / (1 + _lookup(-diff, lambda d: 10 ** (d / 400)))
+
+    # Calculate new ratings (np.rint rounds half to even, like round())
+    new_ratings1 = np.rint(ratings1 + k_factor * (actual_score1 - expected_score1) * multiplier).astype(np.int64)
+    new_ratings2 = np.rint(ratings2 + k_factor * (actual_score2 - expected_score2) * multiplier).astype(np.int64)
+
+    return new_ratings1, new_ratings2
+
+# Rounds with fewer games than this are rated without NumPy in replay_games
+MIN_BATCH_ROUND = 64
+
+def _rate_game(rating1: int, rating2: int, score1: int, score2: int, k_factor: int,
+               multiplier: float) -> tuple[int, int]:
+    """Scalar calculate_elo with a precomputed score multiplier."""
+    total_score = score1 + score2
+    expected_score1 = 1 / (1 + 10 ** ((rating2 - rating1) / 400))
+    expected_score2 = 1 / (1 + 10 ** ((rating1 - rating2) / 400))
+    new_rating1 = round(rating1 + k_factor * (score1 / total_score - expected_score1) * multiplier)
+    new_rating2 = round(rating2 + k_factor * (score2 / total_score - expected_score2) * multiplier)
+    return new_rating1, new_rating2
+
+def _schedule_rounds(players1: np.ndarray, players2: np.ndarray, num_players: int) -> list:
+    """Split games into rounds in which no player appears twice, keeping each player's games in order.
+
+    Returns the game positions of every round, rounds in playing order.
+    """
+    # A game goes one round after the latest round of either of its players
+    last_round = [0] * num_players
+    rounds = []
+    for p1, p2 in zip(players1.tolist(), players2.tolist()):
+        game_round = max(last_round[p1], last_round[p2]) + 1
+        last_round[p1] = last_round[p2] = game_round
+        rounds.append(game_round)
+
+    rounds = np.array(rounds, dtype=np.int64)
+    order = np.argsort(rounds, kind='stable')
+    bounds = np.flatnonzero(np.diff(rounds[order])) + 1
+    return np.split(order, bounds)
+
+def rate_games(players1, players2, scores1, scores2, ratings: np.ndarray,
+               k_factor: int = 32) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Apply games in order to ratings (updated in place), as calculate_elo one game at a time would.
+
+    Players are indices into ratings. Every round of games without a shared player is rated
+    with one calculate_elo_batch call. Returns each game's ratings before and after it:
+    (before1, before2, after1, after2).
+    """
+    players1 = np.asarray(players1, dtype=np.int64)
+    players2 = np.asarray(players2, dtype=np.int64)
+    scores1 = np.asarray(scores1, dtype=np.int64)
+    scores2 = np.asarray(scores2, dtype=np.int64)
+
+    before1 = np.empty(len(players1), dtype=np.int64)
+    before2 = np.empty(len(players1), dtype=np.int64)
+    after1 = np.empty(len(players1), dtype=np.int64)
+    after2 = np.empty(len(players1), dtype=np.int64)
+    if len(players1) == 0:
+        return before1, before2, after1, after2
+
+    multiplier = score_multiplier(scores1, scores2)
+
+    # Small leagues produce many narrow rounds where per-call NumPy overhead dominates,
+    # so those are rated one game at a time on plain Python values instead
+    games1, games2 = players1.tolist(), players2.tolist()
+    points1, points2, factors = scores1.tolist(), scores2.tolist(), multiplier.tolist()
+
+    for games in _schedule_rounds(players1, players2, len(ratings)):
+        if len(games) < MIN_BATCH_ROUND:
+            for game in games.tolist():
+                p1, p2 = games1[game], games2[game]
+                rating1, rating2 = ratings.item(p1), ratings.item(p2)
+                new_rating1, new_rating2 = _rate_game(
+                    rating1, rating2, points1[game], points2[game], k_factor, factors[game]
+                )
+                ratings[p1], ratings[p2] = new_rating1, new_rating2
+                before1[game], before2[game] = rating1, rating2
+                after1[game], after2[game] = new_rating1, new_rating2
+            continue
+
+        p1, p2 = players1[games], players2[games]
+        before1[games], before2[games] = ratings[p1], ratings[p2]
+        after1[games], after2[games] = calculate_elo_batch(
+            before1[games], before2[games], scores1[games], scores2[games],
+            k_factor, multiplier[games]
+        )
+        ratings[p1], ratings[p2] = after1[games], after2[games]
+
+    return before1, before2, after1, after2
+
+def replay_games(players1, players2, scores1, scores2, num_players: int,
+                 initial_rating: int = 1500, k_factor: int = 32) -> tuple[np.ndarray, np.ndarray, tuple]:
+    """Replay games in order from scratch.
+
+    Players are dense indices in range(num_players). Returns final ratings, games played per
+    player and, as rate_games does, every game's (before1, before2, after1, after2).
+    """
+    players1 = np.asarray(players1, dtype=np.int64)
+    players2 = np.asarray(players2, dtype=np.int64)
+
+    ratings = np.full(num_players, initial_rating, dtype=np.int64)
+    games_played = np.bincount(players1, minlength=num_players) + np.bincount(players2, minlength=num_players)
+    history = rate_games(players1, players2, scores1, scores2, ratings, k_factor)
+    return ratings, games_played, history
@@ -0,0 +1,56 @@
+import argparse
+import csv
+import io
+import json
+import sys
+from database import Database
+
+# Output formats with their media types
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+def export_chunks(db: Database, table: str, fmt: str, since_game_id: int = 0, batch_size: int = 1000):
+    """Yield a users or games export as text chunks, one per batch of rows.
+
+    Rows are streamed from the database, so memory use does not grow with the table.
+    """
+    columns = Database.EXPORT_COLUMNS[table]
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(columns)
+        for rows in db.iter_export(table, since_game_id, batch_size):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        # The header alone when nothing matched
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in db.iter_export(table, since_game_id, batch_size):
+            yield "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Export users or confirmed games as CSV or NDJSON.")
+    parser.add_argument("table", choices=sorted(Database.EXPORT_COLUMNS), help="What to export")
+    parser.add_argument("--db", default="ratings.db", help="Path to the ratings database")
+    parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="csv", help="Output format")
+    parser.add_argument("--since", type=int, default=0,
+                        help="Only games with a larger game_id, and for users only the players of those games")
+    parser.add_argument("--output", help="File to write instead of standard output")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    out = open(args.output, 'w', newline='', encoding='utf-8') if args.output else sys.stdout
+    try:
+        for chunk in export_chunks(db, args.table, args.format, args.since):
+            out.write(chunk)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import csv
+import json
+import sys
+from datetime import datetime
+from database import Database
+
+FIELDS = ('player1_index', 'player2_index', 'player1_score', 'player2_score')
+
+def read_records(path: str, fmt: str) -> list:
+    """Read match records as dicts with the FIELDS keys and an optional timestamp."""
+    with open(path, newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            return list(csv.DictReader(f))
+        data = json.load(f)
+    # JSON is a list of objects, or of [player1_index, player2_index, score1, score2, timestamp?] arrays
+    return [
+        record if isinstance(record, dict) else dict(zip(FIELDS + ('timestamp',), record))
+        for record in data
+    ]
+
+def parse_games(db: Database, records: list):
+    """Validate records and turn them into Database.import_games tuples in playing order.
+
+    Every player is looked up in one query. Returns (games, users by id, errors); nothing
+    should be imported unless errors is empty.
+    """
+    errors = []
+    parsed = []
+    for number, record in enumerate(records, 1):
+        try:
+            index1, index2 = str(record['player1_index']).strip(), str(record['player2_index']).strip()
+            score1, score2 = int(record['player1_score']), int(record['player2_score'])
+            timestamp = record.get('timestamp')
+            timestamp = datetime.fromisoformat(str(timestamp)) if timestamp else None
+            if timestamp is not None and timestamp.tzinfo is not None:
+                # Stored timestamps are naive local time, like datetime.now()
+                timestamp = timestamp.astimezone().replace(tzinfo=None)
+        except (KeyError, TypeError, ValueError) as e:
+            errors.append(f"record {number}: cannot parse {record!r} ({e})")
+            continue
+        if index1 == index2:
+            errors.append(f"record {number}: a player cannot play against themselves")
+        elif score1 < 0 or score2 < 0 or score1 + score2 == 0:
+            errors.append(f"record {number}: invalid score {score1}-{score2}")
+        else:
+            parsed.append((number, index1, index2, score1, score2, timestamp))
+
+    users = {user[6]: user for user in db.get_users_by_indexes({index for game in parsed for index in game[1:3]})}
+    for number, index1, index2, *_ in parsed:
+        for index in (index1, index2):
+            if index not in users:
+                errors.append(f"record {number}: no player with index {index}")
+
+    # Games without a timestamp were played now, after the dated ones; ties keep file order
+    now = datetime.now()
+    parsed.sort(key=lambda game: game[5] or now)
+    games = [
+        (users[index1][0], users[index2][0], score1, score2, timestamp or now)
+        for _, index1, index2, score1, score2, timestamp in parsed
+        if index1 in users and index2 in users
+    ]
+    return games, {user[0]: user for user in users.values()}, errors
+
+def main():
+    parser = argparse.ArgumentParser(description="Import already played matches as confirmed games and rate them.")
+    parser.add_argument("file", help="CSV with player1_index,player2_index,player1_score,player2_score[,timestamp] "
+                                     "columns, or a JSON list of such objects or arrays")
+    parser.add_argument("--db", default="ratings.db", help="Path to the ratings database")
+    parser.add_argument("--format", choices=["csv", "json"], help="Input format (default: from the file extension)")
+    parser.add_argument("--k-factor", type=int, default=32, help="K-factor used for the new games")
+    parser.add_argument("--dry-run", action="store_true", help="Validate and show the rating changes without writing them")
+    args = parser.parse_args()
+
+    fmt = args.format or ('json' if args.file.lower().endswith('.json') else 'csv')
+    db = Database(args.db)
+    games, users, errors = parse_games(db, read_records(args.file, fmt))
+    if errors:
+        print("\n".join(errors), file=sys.stderr)
+        print(f"Nothing imported: {len(errors)} invalid records.", file=sys.stderr)
+        sys.exit(1)
+
+    # Ratings are applied on top of the current ones; a later full replay orders by timestamp
+    last_game = db.get_last_game_time()
+    if games and last_game is not None and games[0][4] < last_game:
+        print("Warning: some imported games predate confirmed games; "
+              "run recompute.py to replay every game in order.", file=sys.stderr)
+
+    results = db.import_games(games, args.k_factor, args.dry_run)
+    for game_id, player1_id, player2_id, before1, after1, before2, after2 in results:
+        player1, player2 = users[player1_id], users[player2_id]
+        print(f"{player1[1]} {player1[2]}: {before1} -> {after1}, "
+              f"{player2[1]} {player2[2]}: {before2} -> {after2}")
+
+    action = "would be imported" if args.dry_run else "imported"
+    print(f"{len(results)} games {action}.")
+
+if __name__ == '__main__':
+    main()
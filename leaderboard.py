@@ -0,0 +1,271 @@
+import math
+import random
+import threading
+
+class _Node:
+    __slots__ = ('key', 'next', 'width')
+
+    def __init__(self, key, levels: int):
+        self.key = key
+        self.next = [None] * levels
+        # Number of positions skipped when following next[level]
+        self.width = [1] * levels
+
+class IndexableSkipList:
+    """Sorted list of unique keys with O(log n) insert, remove, rank and positional access."""
+
+    MAX_LEVELS = 32
+
+    def __init__(self, keys=()):
+        # The tail sentinel compares greater than every key, so searches stop on it
+        self._tail = _Node((math.inf,), 0)
+        self._head = _Node(None, self.MAX_LEVELS)
+        self._head.next = [self._tail] * self.MAX_LEVELS
+        self._size = 0
+        # Only the levels in use are walked; the head widths above them are set on activation
+        self._levels = 1
+        self._build(keys)
+
+    def __len__(self):
+        return self._size
+
+    def _random_levels(self) -> int:
+        return min(self.MAX_LEVELS, 1 - int(math.log(1 - random.random(), 2)))
+
+    def _activate_levels(self, levels: int):
+        for level in range(self._levels, levels):
+            self._head.width[level] = self._size + 1
+        self._levels = max(self._levels, levels)
+
+    def _build(self, keys):
+        """Link already sorted keys in one pass."""
+        last = [self._head] * self.MAX_LEVELS
+        last_position = [0] * self.MAX_LEVELS
+        position = 0
+        for position, key in enumerate(keys, 1):
+            node = _Node(key, self._random_levels())
+            for level in range(len(node.next)):
+                last[level].next[level] = node
+                last[level].width[level] = position - last_position[level]
+                last[level] = node
+                last_position[level] = position
+            self._levels = max(self._levels, len(node.next))
+        for level in range(self._levels):
+            last[level].next[level] = self._tail
+            last[level].width[level] = position + 1 - last_position[level]
+        self._size = position
+
+    def _chain(self, key):
+        """Return the last node before key on every level and the position of each of them."""
+        chain = [self._head] * self._levels
+        steps = [0] * self._levels
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                steps[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+        return chain, steps
+
+    def insert(self, key):
+        levels = self._random_levels()
+        self._activate_levels(levels)
+        chain, steps_at_level = self._chain(key)
+        node = _Node(key, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            node.next[level] = previous.next[level]
+            previous.next[level] = node
+            node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, self._levels):
+            chain[level].width[level] += 1
+        self._size += 1
+
+    def remove(self, key):
+        chain, _ = self._chain(key)
+        node = chain[0].next[0]
+        if node.key != key:
+            raise KeyError(key)
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self._levels):
+            chain[level].width[level] -= 1
+        self._size -= 1
+
+    def rank(self, key) -> int:
+        """Return the number of keys smaller than key."""
+        position = 0
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.next[level].key < key:
+                position += node.width[level]
+                node = node.next[level]
+        return position
+
+    def slice(self, start: int, count: int) -> list:
+        """Return up to count keys starting at position start."""
+        if start >= self._size or count <= 0:
+            return []
+        remaining = start + 1
+        node = self._head
+        for level in reversed(range(self._levels)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        keys = []
+        while node is not self._tail and len(keys) < count:
+            keys.append(node.key)
+            node = node.next[0]
+        return keys
+
+class Leaderboard:
+    """Process-local leaderboard ordered by ELO (highest first), ties broken by user_id.
+
+    Ranks follow RANK() semantics like Database.get_user_rankings: tied players share
+    a rank and the following ranks are skipped.
+    """
+
+    # Above this many changed players, a full reload is cheaper than repositioning each one
+    MAX_INCREMENTAL_SYNC = 1000
+
+    def __init__(self):
+        self._order = IndexableSkipList()
+        self._players = {}
+        self._lock = threading.RLock()
+        self._data_version = None
+        self._ratings_version = None
+        self._last_history_id = 0
+        self._version = 0
+
+    def __len__(self):
+        return len(self._players)
+
+    @property
+    def data_version(self):
+        """PRAGMA data_version seen by the last sync, usable as a cache key."""
+        return self._data_version
+    
+    @property
+    def version(self) -> int:
+        """Number of changes applied in this process, usable as a cache key."""
+        return self._version
+
+    @staticmethod
+    def _key(player) -> tuple:
+        return (-player['elo'], player['user_id'])
+
+    def load(self, db):
+        """Replace the whole leaderboard with the users currently in the database."""
+        with self._lock:
+            self._ratings_version = db.get_ratings_version()
+            self._last_history_id = db.get_last_history_id()
+            self._players = {}
+            for row in db.get_users():
+                self._players[row[0]] = self._record(row)
+            self._order = IndexableSkipList(sorted(map(self._key, self._players.values())))
+            self._version += 1
+
+    @staticmethod
+    def _record(row) -> dict:
+        user_id, name, surname, position, elo, games_played, player_index = row
+        return {
+            'user_id': user_id,
+            'name': name,
+            'surname': surname,
+            'position': position,
+            'elo': elo,
+            'games_played': games_played,
+            'player_index': player_index,
+        }
+
+    def set_player(self, row):
+        """Insert or reposition a player from a users table row."""
+        player = self._record(row)
+        with self._lock:
+            old = self._players.get(player['user_id'])
+            if old is not None:
+                self._order.remove(self._key(old))
+            self._players[player['user_id']] = player
+            self._order.insert(self._key(player))
+            self._version += 1
+
+    def sync(self, db):
+        """Pick up rating changes and registrations committed by other processes.
+
+        db must be the same Database on every call, since PRAGMA data_version is
+        only comparable on one connection.
+        """
+        with self._lock:
+            data_version = db.get_data_version()
+            if data_version == self._data_version:
+                return
+
+            # A recompute rewrites every rating and the whole history at once
+            if db.get_ratings_version() != self._ratings_version:
+                self.load(db)
+            else:
+                self._apply_changes(db)
+
+            # Only recorded once the refresh succeeded, so a failed one is retried
+            self._data_version = data_version
+
+    def _apply_changes(self, db):
+        changes = db.get_rating_changes_since(self._last_history_id)
+        user_ids = {user_id for _, user_id in changes}
+        if len(user_ids) > self.MAX_INCREMENTAL_SYNC:
+            self.load(db)
+            return
+
+        if changes:
+            for row in db.get_users(user_ids):
+                self.set_player(row)
+            self._last_history_id = changes[-1][0]
+
+        # Registrations leave no rating history, so fall back to a full reload
+        if db.count_users() != len(self._players):
+            self.load(db)
+
+    def _with_ranks(self, keys: list) -> list:
+        players = []
+        rank = None
+        previous_elo = None
+        for key in keys:
+            player = self._players[key[1]]
+            if player['elo'] != previous_elo:
+                # Competition rank: one more than the number of strictly higher ratings
+                rank = self._order.rank((-player['elo'], -math.inf)) + 1
+                previous_elo = player['elo']
+            players.append(dict(player, rank=rank))
+        return players
+
+    def get_player(self, user_id: int):
+        """Return the player with its rank, or None if unknown."""
+        with self._lock:
+            player = self._players.get(user_id)
+            return self._with_ranks([self._key(player)])[0] if player else None
+
+    def rank(self, user_id: int):
+        """Return the player's global rank, or None if the player is not loaded yet."""
+        with self._lock:
+            player = self._players.get(user_id)
+            if player is None:
+                return None
+            return self._order.rank((-player['elo'], -math.inf)) + 1
+
+    def page(self, page: int, page_size: int = 10) -> list:
+        """Return the players on a 1-based leaderboard page."""
+        with self._lock:
+            start = max(page - 1, 0) * page_size
+            return self._with_ranks(self._order.slice(start, page_size))
+
+    def around(self, user_id: int, radius: int = 2) -> list:
+        """Return the player with up to radius neighbours on each side."""
+        with self._lock:
+            position = self._order.rank(self._key(self._players[user_id]))
+            start = max(position - radius, 0)
+            return self._with_ranks(self._order.slice(start, position + radius + 1 - start))
@@ -1,19 +1,36 @@
-from typing import Final, Dict
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from typing import Final
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application, CommandHandler, ContextTypes, MessageHandler, 
-    filters, ConversationHandler, CallbackContext
+    filters, ConversationHandler, CallbackContext, CallbackQueryHandler
 )
 import logging
+import math
 import os
-from database import Database
-from elo import calculate_elo
+from database import AsyncDatabase
+from leaderboard import Leaderboard
+from metrics import instrument_application, instrumented_request, serve_metrics
+from pending import PendingGameStore
+from webhook import WEBHOOK_BASE_URL, run_webhook
+from datetime import timedelta
 import dotenv
 
 dotenv.load_dotenv()
 
 TOKEN: Final[str] = os.getenv("LELO_BOT_TOKEN")
 BOT_USERNAME: Final[str] = os.getenv("LELO_BOT_USERNAME")
+DATABASE: Final[str] = os.getenv("DATABASE_PATH", "ratings.db")
+METRICS_PORT: Final[str] = os.getenv("LELO_METRICS_PORT")
+WEBHOOK_PORT: Final[int] = int(os.getenv("LELO_WEBHOOK_PORT", "8443"))
+
+# Unconfirmed game reports are deleted after this long
+PENDING_GAME_TTL: Final[timedelta] = timedelta(hours=int(os.getenv("PENDING_GAME_TTL_HOURS", "72")))
+
+# /all_stats pages; names are clipped so a full page stays far below Telegram's 4096 characters
+ALL_STATS_PAGE_SIZE = 30
+MAX_NAME_LENGTH = 64
 
 # States for registration conversation
 NAME, SURNAME, POSITION, CONFIRM = range(4)
@@ -21,8 +38,12 @@ NAME, SURNAME, POSITION, CONFIRM = range(4)
 # States for game reporting conversation
 OPPONENT_ID, SCORE, WAITING_CONFIRMATION = range(3)
 
-# Initialize database
-db = Database()
+# Initialize database, served from its own thread so handlers never block the event loop
+db = AsyncDatabase(DATABASE)
+
+# In-memory leaderboard, loaded once and updated as games are confirmed
+leaderboard = Leaderboard()
+db.run_sync(leaderboard.load)
 
 logging.basicConfig(
     level=logging.INFO,
@@ -30,8 +51,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Store temporary game data
-pending_games: Dict[int, dict] = {}
+# Unconfirmed games, read from the database and cached in memory
+pending_games = PendingGameStore(db)
+
+# Rendered /all_stats pages, valid until the leaderboard changes
+all_stats_pages = {'version': None, 'pages': {}}
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
@@ -54,7 +78,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def register_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    if db.get_user(update.effective_user.id):
+    if await db.get_user(update.effective_user.id):
         await update.message.reply_text("You are already registered!")
         return ConversationHandler.END
     
@@ -89,7 +113,7 @@ async def register_position(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def register_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.message.text.lower() == 'confirm':
-        success = db.register_user(
+        success = await db.register_user(
             update.effective_user.id,
             context.user_data['name'],
             context.user_data['surname'],
@@ -97,7 +121,8 @@ async def register_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         if success:
             # Get the user to retrieve their assigned index
-            user = db.get_user(update.effective_user.id)
+            user = await db.get_user(update.effective_user.id)
+            leaderboard.set_player(user)
             await update.message.reply_text(f"Registration successful! Your starting ELO is 1500.\nYour player index is: {user[6]}")
         else:
             await update.message.reply_text("Registration failed. You might be already registered.")
@@ -107,7 +132,7 @@ async def register_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END
 
 async def report_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = db.get_user(update.effective_user.id)
+    user = await db.get_user(update.effective_user.id)
     if not user:
         await update.message.reply_text("You need to register first! Use /register command.")
         return ConversationHandler.END
@@ -129,7 +154,7 @@ async def report_opponent_id(update: Update, context: ContextTypes.DEFAULT_TYPE)
         return OPPONENT_ID
     
     # Get opponent by player index
-    opponent = db.get_user_by_index(text)
+    opponent = await db.get_user_by_index(text)
     
     if not opponent:
         await update.message.reply_text("Opponent not found. Please check the player index and try again.")
@@ -167,22 +192,17 @@ async def report_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Invalid score: 0-0 is not allowed. Please enter a valid score.")
             return SCORE
             
-        game_id = db.create_game(
+        game_id = await db.create_game(
             update.effective_user.id,
             context.user_data['opponent_id'],
             score1,
             score2
         )
         
-        pending_games[game_id] = {
-            'player1_id': update.effective_user.id,
-            'player2_id': context.user_data['opponent_id'],
-            'score1': score1,
-            'score2': score2
-        }
+        pending_games.add(game_id, update.effective_user.id, context.user_data['opponent_id'], score1, score2)
         
         # Get reporter's name and surname
-        reporter = db.get_user(update.effective_user.id)
+        reporter = await db.get_user(update.effective_user.id)
         reporter_name = f"{reporter[1]} {reporter[2]}"
         
         # Notify opponent
@@ -200,6 +220,17 @@ async def report_score(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Invalid score format. Please use format: 3-1 or type 'cancel' to abort.")
         return SCORE
 
+def confirm_and_track(database, game_id: int):
+    """Confirm a game and put both players' stored rows on the leaderboard.
+
+    Runs on the database thread, so sync_leaderboard cannot apply the same game in between.
+    """
+    result = database.confirm_game_with_ratings(game_id)
+    if result is not None:
+        leaderboard.set_player(result[2])
+        leaderboard.set_player(result[3])
+    return result
+
 async def confirm_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         # Extract game_id from the command text (e.g., /confirm_123)
@@ -210,39 +241,29 @@ async def confirm_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         game_id = int(command_parts[1])
         
-        if game_id not in pending_games:
+        game = await pending_games.get(game_id)
+        if game is None:
             await update.message.reply_text("Game not found or already processed.")
             return
         
-        game = pending_games[game_id]
-        
         # Check if the user is the opponent who should confirm
         if update.effective_user.id != game['player2_id']:
             await update.message.reply_text("You are not authorized to confirm this game.")
             return
-            
-        db.confirm_game(game_id)
         
-        # Get current ratings
-        player1 = db.get_user(game['player1_id'])
-        player2 = db.get_user(game['player2_id'])
-        
-        # Calculate new ratings
-        new_rating1, new_rating2 = calculate_elo(
-            player1[4], player2[4],  # Current ELO ratings
-            game['score1'], game['score2']
-        )
-        
-        # Update ratings
-        db.update_elo(game['player1_id'], new_rating1)
-        db.update_elo(game['player2_id'], new_rating2)
+        # Confirm the game and apply both ratings atomically; a repeated /confirm finds it confirmed
+        pending_games.discard(game_id)
+        result = await db.run(confirm_and_track, game_id)
+        if result is None:
+            await update.message.reply_text("Game not found or already processed.")
+            return
+        player1, player2, updated1, updated2 = result
+        new_rating1, new_rating2 = updated1[4], updated2[4]
         
         # Notify both players
         message = f"Game confirmed! New ratings:\n{player1[1]} {player1[2]}: {new_rating1}\n{player2[1]} {player2[2]}: {new_rating2}"
         await context.bot.send_message(game['player1_id'], message)
         await context.bot.send_message(game['player2_id'], message)
-        
-        del pending_games[game_id]
     except (ValueError, IndexError):
         await update.message.reply_text("Invalid command format. Use /confirm_<game_id>")
 
@@ -256,62 +277,114 @@ async def reject_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
             
         game_id = int(command_parts[1])
         
-        if game_id not in pending_games:
+        game = await pending_games.get(game_id)
+        if game is None:
             await update.message.reply_text("Game not found or already processed.")
             return
         
-        game = pending_games[game_id]
-        
         # Check if the user is the opponent who should confirm/reject
         if update.effective_user.id != game['player2_id']:
             await update.message.reply_text("You are not authorized to reject this game.")
             return
         
-        # Delete the game from database
-        db.delete_game(game_id)
+        # Delete the game from database unless it was confirmed or rejected meanwhile
+        pending_games.discard(game_id)
+        if not await db.delete_pending_game(game_id):
+            await update.message.reply_text("Game not found or already processed.")
+            return
         
         # Notify both players
         message_to_reporter = "Your opponent rejected the game report."
         message_to_rejecter = "You have rejected the game report."
         await context.bot.send_message(game['player1_id'], message_to_reporter)
         await context.bot.send_message(game['player2_id'], message_to_rejecter)
-        
-        del pending_games[game_id]
     except (ValueError, IndexError):
         await update.message.reply_text("Invalid command format. Use /reject_<game_id>")
 
 async def my_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = db.get_user(update.effective_user.id)
-    if not user:
+    player = leaderboard.get_player(update.effective_user.id)
+    if not player:
         await update.message.reply_text("You need to register first! Use /register command.")
         return
     
-    await update.message.reply_text(
+    message = (
         f"Your statistics:\n"
-        f"Name: {user[1]} {user[2]}\n"
-        f"Position: {user[3]}\n"
-        f"ELO Rating: {user[4]}\n"
-        f"Games played: {user[5]}\n"
-        f"Player Index: {user[6]}"
+        f"Name: {player['name']} {player['surname']}\n"
+        f"Position: {player['position']}\n"
+        f"ELO Rating: {player['elo']}\n"
+        f"Rank: {player['rank']} of {len(leaderboard)}\n"
+        f"Games played: {player['games_played']}\n"
+        f"Player Index: {player['player_index']}"
     )
+    
+    # Show the rating trend over the latest confirmed games
+    history = await db.get_rating_history(update.effective_user.id)
+    if history:
+        trend = " -> ".join([str(history[0][1])] + [str(elo_after) for _, _, elo_after, _ in history])
+        message += f"\nRecent ratings: {trend}"
+    
+    await update.message.reply_text(message)
+
+def render_all_stats_page(page: int):
+    """Return the text and navigation buttons of one /all_stats page, rendered once per leaderboard version"""
+    pages = all_stats_pages['pages']
+    if all_stats_pages['version'] != leaderboard.version:
+        pages = {}
+        all_stats_pages['version'] = leaderboard.version
+        all_stats_pages['pages'] = pages
+    
+    total_pages = max(math.ceil(len(leaderboard) / ALL_STATS_PAGE_SIZE), 1)
+    page = min(max(page, 1), total_pages)
+    if page not in pages:
+        lines = [f"All players' ratings (page {page} of {total_pages}):"]
+        for player in leaderboard.page(page, ALL_STATS_PAGE_SIZE):
+            name = f"{player['name']} {player['surname']}"[:MAX_NAME_LENGTH]
+            lines.append(f"{player['rank']}. {name}: {player['elo']}")
+        
+        buttons = []
+        if page > 1:
+            buttons.append(InlineKeyboardButton("« Prev", callback_data=f"all_stats:{page - 1}"))
+        if page < total_pages:
+            buttons.append(InlineKeyboardButton("Next »", callback_data=f"all_stats:{page + 1}"))
+        pages[page] = ("\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None)
+    return pages[page]
 
 async def all_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    users = db.get_all_users()
-    message = "All players' ratings:\n"
-    sorted_users = sorted(users, key=lambda x: x[2], reverse=True)
+    text, keyboard = render_all_stats_page(1)
+    await update.message.reply_text(text, reply_markup=keyboard)
 
-    for i, (name, surname, elo, player_index) in enumerate(sorted_users, 1):
-        message += f"{i}. {name} {surname}: {elo}\n"
-    
-    await update.message.reply_text(message)
+async def all_stats_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show another /all_stats page in place when a navigation button is pressed."""
+    query = update.callback_query
+    await query.answer()
+    text, keyboard = render_all_stats_page(int(query.data.split(':')[1]))
+    try:
+        await query.edit_message_text(text, reply_markup=keyboard)
+    except BadRequest as e:
+        # Pressing a button twice asks for the page that is already shown
+        if "not modified" not in str(e):
+            raise
+
+async def sync_leaderboard(context: CallbackContext):
+    """Pick up rating changes written by other processes, such as import_games.py."""
+    await db.run(leaderboard.sync)
+
+async def purge_expired_games(context: CallbackContext):
+    """Periodically delete game reports nobody confirmed or rejected in time."""
+    await pending_games.purge_expired(PENDING_GAME_TTL)
 
 # Add a cancel handler function
 async def cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("Operation cancelled.")
     return ConversationHandler.END
 
-def main():
-    app = Application.builder().token(TOKEN).build()
+def build_application(request=None) -> Application:
+    """Create the bot application with all handlers; request replaces the HTTP client (e.g. in benchmarks)"""
+    # Bot API calls go through a wrapper that counts them; the pool sizes are PTB's defaults
+    builder = Application.builder().token(TOKEN)
+    builder = builder.request(instrumented_request(request or HTTPXRequest(connection_pool_size=256), 'lelo'))
+    builder = builder.get_updates_request(instrumented_request(request or HTTPXRequest(), 'lelo'))
+    app = builder.build()
     
     # Register conversation handler
     register_handler = ConversationHandler(
@@ -342,6 +415,7 @@ def main():
     app.add_handler(report_handler)
     app.add_handler(CommandHandler('my_stats', my_stats))
     app.add_handler(CommandHandler('all_stats', all_stats))
+    app.add_handler(CallbackQueryHandler(all_stats_page, pattern=r'^all_stats:\d+$'))
     app.add_handler(CommandHandler('confirm', lambda u, c: u.message.reply_text("Use /confirm_<game_id> to confirm a game")))
     app.add_handler(CommandHandler('reject', lambda u, c: u.message.reply_text("Use /reject_<game_id> to reject a game")))
     
@@ -349,9 +423,29 @@ def main():
     app.add_handler(MessageHandler(filters.Regex(r'^/confirm_\d+$'), confirm_game))
     app.add_handler(MessageHandler(filters.Regex(r'^/reject_\d+$'), reject_game))
     
+    # Schedule the expiry sweep for abandoned game reports (every hour)
+    if app.job_queue is None:
+        logger.warning("JobQueue is not available. Please install python-telegram-bot[job-queue]")
+        logger.warning("Expired game reports will not be purged automatically")
+        logger.warning("Ratings changed by other processes will not show until a restart")
+    else:
+        app.job_queue.run_repeating(purge_expired_games, interval=3600, first=60)
+        app.job_queue.run_repeating(sync_leaderboard, interval=5, first=5)
+    
+    instrument_application(app, 'lelo')
+    return app
+
+def main():
+    app = build_application()
+    if METRICS_PORT:
+        serve_metrics(int(METRICS_PORT))
+    
     # Start the bot
     print('Starting bot...')
-    app.run_polling(poll_interval=0.5)
+    if WEBHOOK_BASE_URL:
+        run_webhook('lelo', app, WEBHOOK_PORT)
+    else:
+        app.run_polling(poll_interval=0.5)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,258 @@
+"""Process-wide metrics in the Prometheus text format.
+
+Counters and histograms are registered at import and shared by everything in the
+process: the web app serves them at /metrics and each bot can expose them on its
+own port with serve_metrics.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import functools
+import inspect
+import threading
+import time
+
+# Latency buckets in seconds, from a cached read to a slow write under lock contention
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = []
+
+def _label_order(item) -> tuple:
+    # Label values may mix None with strings, which do not compare
+    return tuple(map(str, item[0]))
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items(), key=_label_order):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {value}")
+        return lines
+
+class Histogram:
+    """Distribution of observed values per label combination, in cumulative buckets."""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][bucket] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted(
+                ((labels, (list(counts), total)) for labels, (counts, total) in self._values.items()),
+                key=_label_order
+            )
+        for labels, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+def render() -> str:
+    """Return every metric of this process in the Prometheus text format."""
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in a bot update handler", ("bot", "handler"))
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Bot update handlers that raised", ("bot", "handler"))
+DATABASE_SECONDS = Histogram("database_call_seconds", "Time spent in a Database method", ("method",))
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "How late the event loop ran a scheduled wakeup", ("bot",))
+TELEGRAM_CALLS = Counter("telegram_api_calls_total", "Bot API requests sent", ("bot", "endpoint"))
+TELEGRAM_ERRORS = Counter("telegram_api_errors_total", "Bot API requests that failed", ("bot", "endpoint"))
+TITLE_BATCH_SECONDS = Histogram("admin_title_batch_seconds", "Duration of one admin title refresh", ("trigger",))
+TITLE_UPDATES = Counter("admin_title_updates_total", "Admin titles handled by refreshes", ("result",))
+HTTP_SECONDS = Histogram("http_request_seconds", "Time to answer a web request", ("endpoint", "status"))
+
+def timed_methods(histogram: Histogram):
+    """Class decorator timing every public method, labelled with the method name.
+
+    Generator methods are skipped, since calling them only creates the generator.
+    """
+    def decorate(cls):
+        for name, method in list(vars(cls).items()):
+            if name.startswith('_') or not inspect.isfunction(method) or inspect.isgeneratorfunction(method):
+                continue
+
+            def timed(method=method, name=name):
+                @functools.wraps(method)
+                def call(*args, **kwargs):
+                    start = time.perf_counter()
+                    try:
+                        return method(*args, **kwargs)
+                    finally:
+                        histogram.observe(time.perf_counter() - start, name)
+                return call
+
+            setattr(cls, name, timed())
+        return cls
+    return decorate
+
+def _handler_name(handler) -> str:
+    name = getattr(handler.callback, '__name__', type(handler.callback).__name__)
+    if name == '<lambda>' and getattr(handler, 'commands', None):
+        name = "/" + "/".join(sorted(handler.commands))
+    return name
+
+def _time_handler(handler, bot: str):
+    from telegram.ext import ConversationHandler
+
+    if isinstance(handler, ConversationHandler):
+        nested = handler.entry_points + handler.fallbacks + [h for hs in handler.states.values() for h in hs]
+        for inner in nested:
+            _time_handler(inner, bot)
+        return
+
+    callback = handler.callback
+    name = _handler_name(handler)
+
+    async def timed(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(bot, name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, bot, name)
+
+    handler.callback = timed
+
+async def monitor_event_loop(bot: str, interval: float = 0.5):
+    """Record how late the running event loop wakes up a sleeping task, forever."""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(time.perf_counter() - start - interval, 0), bot)
+
+def instrument_application(application, bot: str):
+    """Time every handler of a bot application and watch its event loop once it runs."""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            _time_handler(handler, bot)
+
+    previous_post_init = application.post_init
+    previous_post_stop = application.post_stop
+    monitor = None
+
+    async def post_init(app):
+        nonlocal monitor
+        monitor = asyncio.get_running_loop().create_task(monitor_event_loop(bot))
+        if previous_post_init is not None:
+            await previous_post_init(app)
+
+    async def post_stop(app):
+        if monitor is not None:
+            monitor.cancel()
+        if previous_post_stop is not None:
+            await previous_post_stop(app)
+
+    application.post_init = post_init
+    application.post_stop = post_stop
+
+def instrumented_request(request, bot: str):
+    """Wrap a telegram BaseRequest so every Bot API call is counted by endpoint."""
+    from telegram.request import BaseRequest
+
+    class InstrumentedRequest(BaseRequest):
+        @property
+        def read_timeout(self):
+            return request.read_timeout
+
+        async def initialize(self):
+            await request.initialize()
+
+        async def shutdown(self):
+            await request.shutdown()
+
+        async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                             write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                             pool_timeout=BaseRequest.DEFAULT_NONE):
+            endpoint = url.rsplit("/", 1)[-1]
+            TELEGRAM_CALLS.inc(bot, endpoint)
+            try:
+                status, payload = await request.do_request(
+                    url, method, request_data, read_timeout, write_timeout, connect_timeout, pool_timeout
+                )
+            except Exception:
+                TELEGRAM_ERRORS.inc(bot, endpoint)
+                raise
+            if status >= 400:
+                TELEGRAM_ERRORS.inc(bot, endpoint)
+            return status, payload
+
+    return InstrumentedRequest()
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes every few seconds would drown the bot's own log
+        pass
+
+def serve_metrics(port: int, host: str = "127.0.0.1"):
+    """Serve /metrics on host:port from a background thread."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name=f"metrics-{port}", daemon=True).start()
+    return server
@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+class PendingGameStore:
+    """Unconfirmed games read from the games table, with a bounded LRU cache in front.
+
+    Nothing is loaded at startup; games reported before a restart are fetched on
+    first use, so confirmations survive restarts and memory stays bounded.
+    """
+
+    def __init__(self, db, max_size: int = 1024):
+        self.db = db
+        self.max_size = max_size
+        self._cache = OrderedDict()
+
+    def _remember(self, game_id: int, game: dict):
+        self._cache[game_id] = game
+        self._cache.move_to_end(game_id)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+
+    def add(self, game_id: int, player1_id: int, player2_id: int, score1: int, score2: int):
+        """Cache a game that was just written with Database.create_game."""
+        self._remember(game_id, {
+            'player1_id': player1_id,
+            'player2_id': player2_id,
+            'score1': score1,
+            'score2': score2
+        })
+
+    async def get(self, game_id: int):
+        """Return the pending game as a dict, or None if it is unknown or already processed."""
+        game = self._cache.get(game_id)
+        if game is not None:
+            self._cache.move_to_end(game_id)
+            return game
+
+        row = await self.db.get_pending_game(game_id)
+        if row is None:
+            return None
+        player1_id, player2_id, score1, score2, _ = row
+        self.add(game_id, player1_id, player2_id, score1, score2)
+        return self._cache[game_id]
+
+    def discard(self, game_id: int):
+        self._cache.pop(game_id, None)
+
+    async def purge_expired(self, ttl: timedelta, batch_size: int = 500) -> int:
+        """Delete games left unconfirmed for longer than ttl, in batches, and return how many."""
+        cutoff = datetime.now() - ttl
+        purged = 0
+        while True:
+            game_ids = await self.db.delete_expired_games(cutoff, batch_size)
+            for game_id in game_ids:
+                self.discard(game_id)
+            purged += len(game_ids)
+            if len(game_ids) < batch_size:
+                break
+        if purged:
+            logger.info(f"Purged {purged} expired unconfirmed games")
+        return purged
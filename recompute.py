@@ -0,0 +1,82 @@
+import argparse
+import numpy as np
+from database import Database
+from elo import replay_games
+
+def recompute_ratings(db: Database, k_factor: int = 32, initial_rating: int = 1500, dry_run: bool = False):
+    """Rebuild every user's ELO and games_played, and the per-game rating history, by
+    replaying all confirmed games.
+
+    Returns a list of (user_id, name, surname, old_elo, new_elo, old_games, new_games)
+    for every user whose values change. Nothing is written when dry_run is set.
+    """
+    if dry_run:
+        return _replay(db, k_factor, initial_rating)[0]
+
+    # Hold the write lock from the first read to the last write, so a game confirmed by a
+    # bot meanwhile waits for the new ratings instead of being silently overwritten by them
+    db.begin_write()
+    try:
+        changes, history = _replay(db, k_factor, initial_rating)
+        db.set_all_ratings(
+            [(new_elo, new_games, user_id) for user_id, _, _, _, new_elo, _, new_games in changes], history
+        )
+    except Exception:
+        db.conn.rollback()
+        raise
+    return changes
+
+def _replay(db: Database, k_factor: int, initial_rating: int) -> tuple[list, list]:
+    """Return the changed users, as recompute_ratings does, and the rating history rows of every game"""
+    users = db.get_all_ratings()
+    user_ids = np.array([user[0] for user in users], dtype=np.int64)
+
+    # Stream the games table in batches instead of loading it through a single fetchall
+    batches = [np.array(rows, dtype=np.int64) for rows in db.iter_confirmed_games()]
+    games = np.concatenate(batches) if batches else np.empty((0, 5), dtype=np.int64)
+
+    # Drop games whose players no longer exist and map user ids to dense positions
+    games = games[np.isin(games[:, 0], user_ids) & np.isin(games[:, 1], user_ids)]
+    players1 = np.searchsorted(user_ids, games[:, 0])
+    players2 = np.searchsorted(user_ids, games[:, 1])
+
+    ratings, games_played, (before1, before2, after1, after2) = replay_games(
+        players1, players2, games[:, 2], games[:, 3],
+        len(user_ids), initial_rating, k_factor
+    )
+    history = [
+        row
+        for game_id, player1_id, player2_id, elo_before1, elo_after1, elo_before2, elo_after2 in zip(
+            games[:, 4].tolist(), games[:, 0].tolist(), games[:, 1].tolist(),
+            before1.tolist(), after1.tolist(), before2.tolist(), after2.tolist()
+        )
+        for row in ((game_id, player1_id, elo_before1, elo_after1), (game_id, player2_id, elo_before2, elo_after2))
+    ]
+
+    changes = []
+    for (user_id, name, surname, old_elo, old_games), new_elo, new_games in zip(
+        users, ratings.tolist(), games_played.tolist()
+    ):
+        if old_elo != new_elo or old_games != new_games:
+            changes.append((user_id, name, surname, old_elo, new_elo, old_games, new_games))
+    return changes, history
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute all ratings from the confirmed games history.")
+    parser.add_argument("--db", default="ratings.db", help="Path to the ratings database")
+    parser.add_argument("--k-factor", type=int, default=32, help="K-factor used for the replay")
+    parser.add_argument("--initial-rating", type=int, default=1500, help="Rating every player starts from")
+    parser.add_argument("--dry-run", action="store_true", help="Report differences without writing them")
+    args = parser.parse_args()
+
+    db = Database(args.db)
+    changes = recompute_ratings(db, args.k_factor, args.initial_rating, args.dry_run)
+
+    for user_id, name, surname, old_elo, new_elo, old_games, new_games in changes:
+        print(f"{name} {surname} ({user_id}): ELO {old_elo} -> {new_elo}, games {old_games} -> {new_games}")
+
+    action = "would change" if args.dry_run else "updated"
+    print(f"{len(changes)} players {action}.")
+
+if __name__ == '__main__':
+    main()
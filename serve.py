@@ -0,0 +1,20 @@
+"""Run the web leaderboard and both bots in one process.
+
+The bots receive updates through webhooks served by the leaderboard's Flask app
+at /telegram/lelo and /telegram/admin. Set WEBHOOK_BASE_URL to the public HTTPS
+address of this server so the webhooks are registered with Telegram. Run on their
+own instead, each bot serves its webhook on LELO_WEBHOOK_PORT or ADMIN_WEBHOOK_PORT.
+"""
+import os
+import admin_bot
+import lelo_bot
+from app import app
+from webhook import attach_bot
+
+def main():
+    attach_bot(app, 'lelo', lelo_bot.build_application())
+    attach_bot(app, 'admin', admin_bot.build_application())
+    app.run(host='0.0.0.0', port=int(os.getenv("PORT", "5000")), threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+from typing import Final
+from flask import Blueprint, Flask, abort, request
+from telegram import Update
+from telegram.ext import Application
+import asyncio
+import atexit
+import logging
+import os
+import secrets
+import threading
+import dotenv
+
+dotenv.load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Public HTTPS base URL Telegram should deliver updates to; polling is used when unset
+WEBHOOK_BASE_URL: Final[str] = os.getenv("WEBHOOK_BASE_URL")
+WEBHOOK_SECRET: Final[str] = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+WEBHOOK_HOST: Final[str] = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+
+def webhook_path(name: str) -> str:
+    return f"/telegram/{name}"
+
+def start_application(name: str, application: Application, webhook_url: str = None, secret_token: str = None):
+    """Run a bot application on its own event loop thread and return that loop.
+
+    Updates are not fetched by polling; they are fed in by telegram_blueprint.
+    """
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, name=f"bot-{name}", daemon=True)
+    thread.start()
+
+    async def startup():
+        # The same steps as Application.run_polling/run_webhook, which are not used here
+        await application.initialize()
+        if application.post_init is not None:
+            await application.post_init(application)
+        await application.start()
+        if webhook_url:
+            await application.bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+
+    async def shutdown():
+        await application.stop()
+        if application.post_stop is not None:
+            await application.post_stop(application)
+        await application.shutdown()
+
+    asyncio.run_coroutine_threadsafe(startup(), loop).result()
+    atexit.register(lambda: asyncio.run_coroutine_threadsafe(shutdown(), loop).result(timeout=10))
+    return loop
+
+def telegram_blueprint(name: str, application: Application, loop, secret_token: str = None) -> Blueprint:
+    """Flask blueprint receiving Telegram webhook updates for one bot."""
+    blueprint = Blueprint(f"telegram_{name}", __name__)
+
+    @blueprint.route(webhook_path(name), methods=['POST'])
+    def receive_update():
+        if secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret_token:
+            abort(403)
+        update = Update.de_json(request.get_json(force=True), application.bot)
+        # Hand the update to the bot's event loop and answer Telegram right away
+        asyncio.run_coroutine_threadsafe(application.update_queue.put(update), loop).result()
+        return "", 200
+
+    return blueprint
+
+def attach_bot(flask_app: Flask, name: str, application: Application):
+    """Start a bot in webhook mode and route its updates through flask_app."""
+    webhook_url = f"{WEBHOOK_BASE_URL.rstrip('/')}{webhook_path(name)}" if WEBHOOK_BASE_URL else None
+    loop = start_application(name, application, webhook_url, WEBHOOK_SECRET)
+    flask_app.register_blueprint(telegram_blueprint(name, application, loop, WEBHOOK_SECRET))
+    logger.info(f"Bot {name} receiving updates on {webhook_path(name)}")
+
+def run_webhook(name: str, application: Application, port: int):
+    """Serve a single bot in webhook mode on WEBHOOK_HOST:port.
+
+    Bots run this way each need their own port, with WEBHOOK_BASE_URL/telegram/<name>
+    routed to it; serve.py runs both bots behind a single port instead.
+    """
+    flask_app = Flask(name)
+    attach_bot(flask_app, name, application)
+    flask_app.run(host=WEBHOOK_HOST, port=port, threaded=True)